@@ -1,7 +1,11 @@
 import streamlit as st
 from modules.nav import sidebar
+from modules.warmup import warm_up
 
 def main():
+    # loads the data of every page in the background
+    warm_up()
+
     # builds the sidebar menu
     sidebar()
 
@@ -0,0 +1,109 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+from modules.data import artifact_path, atomic_path, load_table
+
+ICU_ADMISSIONS = 'ICU_ADMISSIONS'
+ICU_TRANSFERS = 'ICU_TRANSFERS'
+
+
+def counts_path(name: str) -> str:
+    return artifact_path(f'{name}.npz')
+
+
+def save_counts(name: str, counts: np.ndarray, axes: dict):
+
+    # Dense count array plus the labels of its axes, in one file so that a
+    # reader never sees new counts with old labels
+    with atomic_path(counts_path(name)) as tmp:
+        np.savez(tmp, counts=counts, years=np.asarray(axes['years'], dtype=np.int64),
+                 units=np.asarray(axes['units'], dtype=str))
+
+
+def load_counts(name: str, build) -> dict:
+
+    if not os.path.exists(counts_path(name)):
+        return build()
+
+    with np.load(counts_path(name)) as arrays:
+        return {
+            'years': arrays['years'].tolist(),
+            'units': arrays['units'].tolist(),
+            'counts': arrays['counts'],
+        }
+
+
+def build_admission_counts() -> dict:
+
+    data = load_table('ICUSTAYS', columns=['FIRST_CAREUNIT', 'INTIME'])
+    data = data.dropna()
+
+    years = data['INTIME'].dt.year.to_numpy()
+    first = int(years.min()) if len(years) else 0
+    year = years - first
+    unit, units = pd.factorize(data['FIRST_CAREUNIT'], sort=True)
+    weekday = data['INTIME'].dt.weekday.to_numpy()
+    hour = data['INTIME'].dt.round('h').dt.hour.to_numpy()
+
+    # ICU admissions by year x first care unit x weekday x hour
+    shape = (int(year.max()) + 1 if len(year) else 0, len(units), 7, 24)
+    flat = np.ravel_multi_index((year, unit, weekday, hour), shape)
+    counts = np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape).astype(np.int32)
+
+    axes = {
+        'years': list(range(first, first + shape[0])),
+        'units': [str(unit) for unit in units],
+    }
+    save_counts(ICU_ADMISSIONS, counts, axes)
+    axes['counts'] = counts
+
+    return axes
+
+
+def load_admission_counts() -> dict:
+    return load_counts(ICU_ADMISSIONS, build_admission_counts)
+
+
+def load_transfers(columns: list[str] = None) -> pd.DataFrame:
+
+    # Transfers between two known care units
+    data = load_table('TRANSFERS', 
+                      columns=columns or ['SUBJECT_ID', 'HADM_ID', 'EVENTTYPE', 'PREV_CAREUNIT', 
+                                          'CURR_CAREUNIT', 'INTIME', 'OUTTIME'],
+                      filter=ds.field('EVENTTYPE') == 'transfer')
+
+    return data.dropna()
+
+
+def build_transfer_counts() -> dict:
+
+    data = load_transfers()
+
+    years = data['INTIME'].dt.year.to_numpy()
+    first = int(years.min()) if len(years) else 0
+    year = years - first
+    units = np.unique(np.concatenate([data['PREV_CAREUNIT'].astype(str).unique(),
+                                      data['CURR_CAREUNIT'].astype(str).unique()]))
+    prev = np.searchsorted(units, data['PREV_CAREUNIT'].astype(str))
+    curr = np.searchsorted(units, data['CURR_CAREUNIT'].astype(str))
+
+    # Transfers by year x previous care unit x current care unit
+    shape = (int(year.max()) + 1 if len(year) else 0, len(units), len(units))
+    flat = np.ravel_multi_index((year, prev, curr), shape)
+    counts = np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape).astype(np.int32)
+
+    axes = {
+        'years': list(range(first, first + shape[0])),
+        'units': [str(unit) for unit in units],
+    }
+    save_counts(ICU_TRANSFERS, counts, axes)
+    axes['counts'] = counts
+
+    return axes
+
+
+def load_transfer_counts() -> dict:
+    return load_counts(ICU_TRANSFERS, build_transfer_counts)
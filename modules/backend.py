@@ -0,0 +1,308 @@
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+from dotenv import load_dotenv
+
+from modules.aggregates import load_admission_counts, load_transfer_counts
+from modules.cache import cached
+from modules.cooccurrence import get_diagnoses, get_edges, load_cooccurrence
+from modules.data import get_table, load_table
+from modules.etl import tables_of
+from modules.labs import GENDERS, SEED, load_lab_catalog, read_lab_sample
+from modules.timeindex import TimeIndex, load_time_index
+
+load_dotenv('.env')
+BACKEND = os.getenv('BACKEND', 'index')
+BATCH_ROWS = int(os.getenv('BATCH_ROWS', 1 << 17))
+
+DAYS = ['Monday','Tuesday','Wednesday','Thursday','Friday','Saturday', 'Sunday']
+EDGE_COLUMNS = ['source', 'target', 'weight', 'category']
+TRANSFER_COLUMNS = ['prev_careunit', 'curr_careunit', 'value']
+
+
+def year_range(yr: int | tuple[int, int]) -> tuple[int, int]:
+
+    # A single year or an inclusive (start, end) range of years
+    if isinstance(yr, (tuple, list)):
+        return int(yr[0]), int(yr[1])
+
+    return int(yr), int(yr)
+
+
+@cached(pin=True, tables=tables_of('cooccurrence'))
+def _cooccurrence() -> dict:
+    return load_cooccurrence()
+
+
+@cached(pin=True, tables=tables_of('admission_counts'))
+def _admission_counts() -> dict:
+    return load_admission_counts()
+
+
+@cached(pin=True, tables=tables_of('transfer_counts'))
+def _transfer_counts() -> dict:
+    return load_transfer_counts()
+
+
+@cached(pin=True, tables=tables_of('lab_catalog'))
+def _lab_catalog() -> pd.DataFrame:
+    return load_lab_catalog()
+
+
+@cached(pin=True, tables=['ADMISSIONS'])
+def _admission_times() -> TimeIndex:
+    return load_time_index('ADMISSIONS', 'ADMITTIME', ['HADM_ID', 'ADMITTIME'])
+
+
+@cached(pin=True, tables=['ICUSTAYS'])
+def _icustay_times() -> TimeIndex:
+    return load_time_index('ICUSTAYS', 'INTIME', ['FIRST_CAREUNIT', 'INTIME'], by='FIRST_CAREUNIT')
+
+
+@cached(pin=True, tables=['TRANSFERS'])
+def _transfer_times() -> TimeIndex:
+    return load_time_index('TRANSFERS', 'INTIME',
+                           ['SUBJECT_ID', 'HADM_ID', 'PREV_CAREUNIT', 'CURR_CAREUNIT',
+                            'INTIME', 'OUTTIME'],
+                           by='PREV_CAREUNIT', filter=ds.field('EVENTTYPE') == 'transfer')
+
+
+class IndexBackend:
+
+    # Answers every query from the artifacts precomputed by modules.etl
+
+    def diagnoses(self, yr: int) -> pd.Series:
+        return get_diagnoses(_cooccurrence(), yr)
+
+    def edges(self, category: str, diagnosis_desc: list[str], yr: int, top: int = 30) -> pd.DataFrame:
+        return get_edges(_cooccurrence(), category, diagnosis_desc, yr, top)
+
+    def admission_axes(self) -> dict:
+        counts = _admission_counts()
+        return {'years': counts['years'], 'units': counts['units']}
+
+    def pivot(self, yr: int | tuple[int, int], units: list[str]) -> pd.DataFrame:
+
+        counts = _admission_counts()
+        yr_start, yr_end = year_range(yr)
+        first = counts['years'][0] if counts['years'] else 0
+        years = slice(max(yr_start - first, 0), max(yr_end - first + 1, 0))
+        units = np.isin(counts['units'], units) if units else slice(None)
+
+        # Admissions by weekday x hour, summed over the selected years and units
+        pivot_table = counts['counts'][years][:, units].sum(axis=(0, 1))
+
+        return pd.DataFrame(pivot_table, index=DAYS, columns=range(24))
+
+    def transfer_axes(self) -> dict:
+        counts = _transfer_counts()
+        return {'years': counts['years'], 'units': counts['units']}
+
+    def transfers(self, unit: str | None, yr: int | tuple[int, int]) -> pd.DataFrame:
+
+        counts = _transfer_counts()
+        yr_start, yr_end = year_range(yr)
+        first = counts['years'][0] if counts['years'] else 0
+        matrix = counts['counts'][max(yr_start - first, 0):max(yr_end - first + 1, 0)].sum(axis=0)
+        np.fill_diagonal(matrix, 0)
+
+        # Flows out of one unit, or out of every unit
+        units = np.asarray(counts['units'])
+        if unit is not None:
+            matrix[units != unit] = 0
+
+        prev, curr = np.nonzero(matrix)
+
+        return pd.DataFrame(dict(zip(TRANSFER_COLUMNS, [units[prev], units[curr], matrix[prev, curr]])))
+
+    def lab_counts(self) -> pd.DataFrame:
+        return _lab_catalog()
+
+    def lab_readings(self, itemid: int, sampling_size: float, columns: list[str]) -> pd.DataFrame:
+
+        catalog = _lab_catalog()
+        entry = catalog[catalog['ITEMID'] == itemid].iloc[0]
+
+        return read_lab_sample(entry, sampling_size, columns=columns)
+
+
+def _batches(name: str, columns: list[str], filter: ds.Expression = None):
+
+    # Stream a table, at most BATCH_ROWS rows are materialized at a time
+    scanner = get_table(name).scanner(columns=columns, filter=filter, batch_size=BATCH_ROWS)
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def _total(parts: list[pd.Series], names: list[str]) -> pd.Series:
+
+    # Add up the partial counts of every batch
+    if not parts:
+        return pd.Series([], dtype='int64', index=pd.MultiIndex.from_arrays([[]] * len(names), names=names))
+
+    return pd.concat(parts).groupby(level=names).sum()
+
+
+class DatasetBackend:
+
+    # Answers every query by streaming the parquet tables, so peak memory
+    # follows BATCH_ROWS and the size of the answer, not the table size.
+    # Only the admission, ICU stay and transfer times are held in memory,
+    # in time indexes that slice a year range without scanning
+
+    def _admissions(self, yr: int) -> list[int]:
+        return _admission_times().slice(yr)['HADM_ID'].tolist()
+
+    def _diagnosis_rows(self, yr: int, titles: pd.DataFrame) -> pd.DataFrame:
+
+        # Diagnosis rows of the year's admissions with their long titles
+        hadm, codes = self._admissions(yr), titles['ICD9_CODE'].tolist()
+        rows = []
+        if hadm and codes:
+            predicate = ds.field('HADM_ID').isin(hadm) & ds.field('ICD9_CODE').isin(codes)
+            rows = list(_batches('DIAGNOSES_ICD', ['HADM_ID', 'ICD9_CODE'], predicate))
+        rows = pd.concat(rows) if rows else pd.DataFrame(columns=['HADM_ID', 'ICD9_CODE'])
+
+        return pd.merge(rows, titles, on='ICD9_CODE')
+
+    @cached(tables=['ADMISSIONS', 'DIAGNOSES_ICD', 'D_ICD_DIAGNOSES'])
+    def diagnoses(self, yr: int) -> pd.Series:
+
+        titles = load_table('D_ICD_DIAGNOSES', columns=['ICD9_CODE', 'LONG_TITLE'])
+        rows = self._diagnosis_rows(yr, titles)
+        rows = rows.drop_duplicates(['HADM_ID', 'LONG_TITLE'])
+
+        counts = rows['LONG_TITLE'].astype(str).value_counts()
+        counts = counts.rename_axis('LONG_TITLE').reset_index(name='ADMISSIONS')
+        counts = counts.sort_values(['ADMISSIONS', 'LONG_TITLE'], ascending=[False, True])
+
+        return pd.Series(counts['ADMISSIONS'].to_numpy(), index=counts['LONG_TITLE'].to_numpy(),
+                         name='ADMISSIONS')
+
+    @cached(tables=tables_of('cooccurrence'))
+    def edges(self, category: str, diagnosis_desc: list[str], yr: int, top: int = 30) -> pd.DataFrame:
+
+        titles = load_table('D_ICD_DIAGNOSES', columns=['ICD9_CODE', 'LONG_TITLE'])
+        titles = titles[titles['LONG_TITLE'].isin(diagnosis_desc)]
+        diagnosis = self._diagnosis_rows(yr, titles)
+        if diagnosis.empty:
+            return pd.DataFrame(columns=EDGE_COLUMNS)
+        diagnosis = diagnosis.groupby(['HADM_ID', 'LONG_TITLE'], observed=True).size()
+
+        # Procedure (drug) rows per admission of the selected diagnoses
+        hadm = ds.field('HADM_ID').isin(diagnosis.index.unique('HADM_ID').tolist())
+        if category == 'proc':
+            labels = load_table('D_ICD_PROCEDURES', columns=['ICD9_CODE', 'LONG_TITLE'])
+            labels = labels.set_index('ICD9_CODE')['LONG_TITLE'].astype(str)
+            batches = (batch.assign(LABEL=batch['ICD9_CODE'].map(labels))
+                       for batch in _batches('PROCEDURES_ICD', ['HADM_ID', 'ICD9_CODE'], hadm))
+        else:
+            batches = (batch.assign(LABEL=batch['DRUG'].astype(str).where(batch['DRUG'].notnull()))
+                       for batch in _batches('PRESCRIPTIONS', ['HADM_ID', 'DRUG'], hadm))
+        events = _total([batch.groupby(['HADM_ID', 'LABEL']).size() for batch in batches],
+                        ['HADM_ID', 'LABEL'])
+
+        # Rows of the diagnosis x procedure (drug) join per edge
+        pairs = pd.merge(diagnosis.rename('D').reset_index(), events.rename('E').reset_index(),
+                         on='HADM_ID')
+        pairs['weight'] = pairs['D'] * pairs['E']
+        edges = pairs.groupby(['LONG_TITLE', 'LABEL'], observed=True)['weight'].sum().reset_index()
+        edges.columns = ['source', 'target', 'weight']
+        edges['source'] = edges['source'].astype(str)
+        edges['category'] = category
+        edges = edges.sort_values(by='weight', ascending=False)
+
+        return edges.head(top)
+
+    @cached(tables=['ICUSTAYS'])
+    def admission_axes(self) -> dict:
+
+        index = _icustay_times()
+
+        return {'years': index.years(), 'units': index.keys}
+
+    @cached(tables=['ICUSTAYS'])
+    def pivot(self, yr: int | tuple[int, int], units: list[str]) -> pd.DataFrame:
+
+        # Admissions by weekday x hour of the selected years and units
+        stays = _icustay_times().slice(yr, list(units))
+        cell = stays['INTIME'].dt.weekday * 24 + stays['INTIME'].dt.round('h').dt.hour
+        pivot_table = np.bincount(cell, minlength=7 * 24)
+
+        return pd.DataFrame(pivot_table.reshape(7, 24), index=DAYS, columns=range(24))
+
+    @cached(tables=['TRANSFERS'])
+    def transfer_axes(self) -> dict:
+
+        transfers = _transfer_times().data.dropna(subset=['CURR_CAREUNIT'])
+        years = transfers['INTIME'].dt.year
+        units = set(transfers['PREV_CAREUNIT'].astype(str)) | set(transfers['CURR_CAREUNIT'].astype(str))
+
+        return {'years': list(range(years.min(), years.max() + 1)) if len(years) else [],
+                'units': sorted(units)}
+
+    @cached(tables=['TRANSFERS'])
+    def transfers(self, unit: str | None, yr: int | tuple[int, int]) -> pd.DataFrame:
+
+        # Flows out of one unit, or out of every unit
+        transfers = _transfer_times().slice(yr, None if unit is None else [unit])
+        transfers = transfers.dropna().astype({'PREV_CAREUNIT': str, 'CURR_CAREUNIT': str})
+        transfers = transfers[transfers['PREV_CAREUNIT'] != transfers['CURR_CAREUNIT']]
+        parts = [transfers.groupby(['PREV_CAREUNIT', 'CURR_CAREUNIT']).size()] if len(transfers) else []
+
+        agg = _total(parts, ['PREV_CAREUNIT', 'CURR_CAREUNIT']).sort_index().reset_index()
+        agg.columns = TRANSFER_COLUMNS
+
+        return agg
+
+    @cached(tables=['LABEVENTS'])
+    def lab_counts(self) -> pd.DataFrame:
+
+        predicate = ds.field('HADM_ID').is_valid() & ds.field('VALUENUM').is_valid()
+        counts = _total([batch.groupby('ITEMID').size()
+                         for batch in _batches('LABEVENTS', ['ITEMID'], predicate)], ['ITEMID'])
+
+        return counts.rename('ROWS').reset_index()
+
+    def lab_readings(self, itemid: int, sampling_size: float, columns: list[str]) -> pd.DataFrame:
+
+        patients = load_table('PATIENTS', columns=['SUBJECT_ID', 'GENDER'])
+        patients = patients[patients['GENDER'].isin(GENDERS)]
+        predicate = (ds.field('ITEMID') == itemid) \
+                    & ds.field('HADM_ID').is_valid() \
+                    & ds.field('VALUENUM').is_valid()
+        scan = [column for column in columns if column != 'GENDER']
+        scan += ['SUBJECT_ID'] if 'SUBJECT_ID' not in scan else []
+
+        # Fixed-seed Bernoulli sample, so the readings never need to fit in
+        # memory before being sampled
+        rng = np.random.default_rng(SEED)
+        parts = []
+        for batch in _batches('LABEVENTS', scan, predicate):
+            if sampling_size < 100:
+                batch = batch[rng.random(len(batch)) < sampling_size / 100]
+            parts.append(pd.merge(batch, patients, on='SUBJECT_ID'))
+        if not parts:
+            return pd.DataFrame(columns=columns)
+
+        return pd.concat(parts, ignore_index=True)[columns]
+
+
+BACKENDS = {
+    'index': IndexBackend,
+    'dataset': DatasetBackend,
+}
+
+
+@functools.cache
+def get_backend(name: str = None):
+
+    name = name or BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown BACKEND {name!r}, expected one of {", ".join(BACKENDS)}')
+
+    return BACKENDS[name]()
@@ -0,0 +1,177 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from modules import synthetic
+from modules.perf import PeakRSS
+
+ROOT = os.getenv('BENCH_DIR') or os.path.join(tempfile.gettempdir(), 'mimic_bench')
+REPEAT = 3
+
+CASES = [
+    'viz_1.get_drugs', 'viz_1.get_procs', 'viz_2.get_pivot', 'viz_3.aggregate_data',
+    'viz_3.get_pathways', 'viz_4.get_lab_readings', 'viz_5.load_data', 'viz_5.filter_data',
+]
+
+
+def _params() -> dict:
+
+    # Query parameters picked from the data itself, outside the page caches
+    from modules.data import load_table
+    from modules.labs import load_lab_catalog
+
+    admissions = load_table('ADMISSIONS', columns=['HADM_ID', 'ADMITTIME'])
+    years = admissions['ADMITTIME'].dt.year
+    yr = int(years.mode()[0])
+    hadm = admissions.loc[years == yr, 'HADM_ID']
+
+    diagnosis = load_table('DIAGNOSES_ICD', columns=['HADM_ID', 'ICD9_CODE'])
+    diagnosis = diagnosis[diagnosis['HADM_ID'].isin(hadm)]
+    titles = load_table('D_ICD_DIAGNOSES', columns=['ICD9_CODE', 'LONG_TITLE'])
+    top = diagnosis['ICD9_CODE'].value_counts().index[:3]
+    diagnoses = titles.loc[titles['ICD9_CODE'].isin(top), 'LONG_TITLE'].astype(str).tolist()
+
+    catalog = load_lab_catalog()
+
+    return {
+        'yr': yr,
+        'years': (int(years.min()), int(years.max())),
+        'diagnoses': sorted(diagnoses),
+        'itemid': int(catalog.loc[catalog['ROWS'].idxmax(), 'ITEMID']),
+    }
+
+
+def cases(params: dict) -> dict:
+
+    # The load and aggregation entry point of every page, as the page calls it
+    from pages import viz_1, viz_2, viz_3, viz_4, viz_5
+
+    yr, years = params['yr'], tuple(params['years'])
+
+    return {
+        'viz_1.get_drugs': lambda: viz_1.get_drugs(params['diagnoses'], yr, 30),
+        'viz_1.get_procs': lambda: viz_1.get_procs(params['diagnoses'], yr, 30),
+        'viz_2.get_pivot': lambda: viz_2.get_pivot(years, []),
+        'viz_3.aggregate_data': lambda: viz_3.aggregate_data(viz_3.ALL_UNITS, years),
+        'viz_3.get_pathways': lambda: viz_3.get_pathways(years, 4, 4),
+        'viz_4.get_lab_readings': lambda: viz_4.get_lab_readings(params['itemid'], 100),
+        'viz_5.load_data': lambda: viz_5.load_data(),
+        'viz_5.filter_data': lambda: viz_5.filter_data(viz_5.load_data(), *years, ['CCU', 'MICU', 'SICU']),
+    }
+
+
+def measure(func) -> dict:
+
+    # Wall time and peak resident memory above the level before the call
+    with PeakRSS() as memory:
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+
+    return {
+        'seconds': seconds,
+        'peak_mb': memory.delta_mb,
+        'rows': len(result) if hasattr(result, '__len__') else None,
+    }
+
+
+def run_case(name: str, params: dict, repeat: int = REPEAT) -> dict:
+
+    # First call is cold (artifacts read from disk), the rest hit the cache
+    func = cases(params)[name]
+    cold = measure(func)
+    warm = [measure(func)['seconds'] for _ in range(repeat)]
+
+    return {
+        'case': name,
+        'cold_s': round(cold['seconds'], 4),
+        'warm_s': round(min(warm), 4) if warm else None,
+        'peak_mb': round(cold['peak_mb'], 1),
+        'rows': cold['rows'],
+    }
+
+
+def _child(env: dict, *args) -> list[dict]:
+
+    # Every case runs in a fresh interpreter, so caches and peak memory
+    # start from scratch and the DIR/CACHE of the scale are picked up
+    output = subprocess.run([sys.executable, '-m', 'modules.benchmark', *args],
+                            env=env, check=True, capture_output=True, text=True).stdout
+
+    return [json.loads(line) for line in output.splitlines() if line.startswith('{')]
+
+
+def benchmark(scales: list[str], root: str = ROOT, names: list[str] = None,
+              backend: str = None, repeat: int = REPEAT) -> list[dict]:
+
+    results = []
+    for scale in scales:
+        patients = synthetic.SCALES[scale]
+        source = os.path.join(root, scale)
+        env = dict(os.environ, DIR=source, CACHE=os.path.join(source, 'parquet'))
+        if backend:
+            env['BACKEND'] = backend
+
+        if not os.path.exists(os.path.join(source, 'LABEVENTS.csv.gz')):
+            start = time.perf_counter()
+            synthetic.generate(source, patients)
+            results.append({'scale': scale, 'case': 'synthetic.generate',
+                            'cold_s': round(time.perf_counter() - start, 4)})
+
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'modules.etl', 'build'], env=env, check=True,
+                       capture_output=True)
+        results.append({'scale': scale, 'case': 'etl.build',
+                        'cold_s': round(time.perf_counter() - start, 4)})
+
+        params = _child(env, 'params')[0]
+        for name in names or CASES:
+            for result in _child(env, 'case', name, json.dumps(params), str(repeat)):
+                results.append({'scale': scale, 'backend': env.get('BACKEND', 'index'), **result})
+                print(json.dumps(results[-1]), file=sys.stderr)
+
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Time and memory profile the page data paths')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('run', help='benchmark every page at the given scales')
+    command.add_argument('scales', nargs='*', default=['demo'],
+                         help=f'scales to run, demo by default: {", ".join(synthetic.SCALES)}')
+    command.add_argument('--root', default=ROOT, help='directory for the generated data')
+    command.add_argument('--case', action='append', dest='cases', choices=CASES,
+                         help='only run this case, can be repeated')
+    command.add_argument('--backend', help='BACKEND to benchmark, index by default')
+    command.add_argument('--repeat', type=int, default=REPEAT, help='warm calls per case')
+    command.add_argument('--output', help='write the results as JSON lines')
+
+    commands.add_parser('params')
+    command = commands.add_parser('case')
+    command.add_argument('name')
+    command.add_argument('params')
+    command.add_argument('repeat', type=int)
+    args = parser.parse_args()
+
+    if args.command == 'params':
+        print(json.dumps(_params()))
+    elif args.command == 'case':
+        print(json.dumps(run_case(args.name, json.loads(args.params), args.repeat)))
+    else:
+        unknown = set(args.scales) - set(synthetic.SCALES)
+        if unknown:
+            parser.error(f'unknown scales: {", ".join(sorted(unknown))}')
+        results = benchmark(args.scales, args.root, args.cases, args.backend, args.repeat)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.writelines(json.dumps(result) + '\n' for result in results)
+
+        print(pd.DataFrame(results).to_string(index=False))
@@ -0,0 +1,198 @@
+import functools
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import scipy.sparse as sp
+from dotenv import load_dotenv
+
+from modules.sources import version
+
+load_dotenv('.env')
+BUDGET = int(os.getenv('CACHE_BUDGET_MB', 2048)) << 20
+
+
+def sizeof(value) -> int:
+
+    # Approximate in-memory footprint of the objects the loaders return
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, (np.ndarray, pa.Table, pa.Array)):
+        return int(value.nbytes)
+    if sp.issparse(value):
+        return int(value.data.nbytes + value.indices.nbytes + value.indptr.nbytes)
+    if isinstance(value, dict):
+        return sum(sizeof(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(sizeof(item) for item in value)
+
+    return sys.getsizeof(value)
+
+
+def freeze(value):
+
+    # Hashable cache key from loader arguments
+    if isinstance(value, (list, tuple, set)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+
+    return value
+
+
+class TableCache:
+
+    def __init__(self, budget: int = BUDGET):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.pinned = set()
+        self.depends = {}
+        self.hits = self.misses = self.evictions = 0
+        self._lock = threading.Lock()
+        self._loading = {}
+        # hits and misses of the calling thread, a rerun of one session
+        self._thread = threading.local()
+
+    @property
+    def used(self) -> int:
+        return sum(self.sizes.values())
+
+    def get(self, key, loader, pin: bool = False, tables: tuple[str] = None):
+
+        with self._lock:
+            if key in self.entries:
+                self._count('hits')
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        # Concurrent sessions asking for the same table wait for one load,
+        # a failed load lets the next caller try again
+        try:
+            with loading:
+                with self._lock:
+                    if key in self.entries:
+                        self._count('hits')
+                        self.entries.move_to_end(key)
+                        return self.entries[key]
+                    self._count('misses')
+
+                value = loader()
+                self.put(key, value, pin, tables)
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+
+        return value
+
+    def _count(self, kind: str):
+        setattr(self, kind, getattr(self, kind) + 1)
+        setattr(self._thread, kind, getattr(self._thread, kind, 0) + 1)
+
+    def put(self, key, value, pin: bool = False, tables: tuple[str] = None):
+
+        size = sizeof(value)
+        with self._lock:
+            if pin:
+                self.pinned.add(key)
+            elif size > self.budget:
+                return
+
+            self.entries[key] = value
+            self.sizes[key] = size
+            self.depends[key] = tables
+            self.entries.move_to_end(key)
+            self._evict()
+
+    def _evict(self):
+
+        # Least recently used first, pinned tables are never evicted
+        for key in list(self.entries):
+            if self.used <= self.budget:
+                break
+            if key in self.pinned:
+                continue
+            del self.entries[key]
+            del self.sizes[key]
+            del self.depends[key]
+            self.evictions += 1
+
+    def pin(self, key):
+        with self._lock:
+            self.pinned.add(key)
+
+    def unpin(self, key):
+        with self._lock:
+            self.pinned.discard(key)
+            self._evict()
+
+    def invalidate(self, tables: list[str]) -> int:
+
+        # Drops every entry computed from one of the tables, pinned or not.
+        # Entries without known tables may depend on any of them
+        tables = set(tables)
+        with self._lock:
+            stale = [key for key in self.entries
+                     if self.depends[key] is None or tables & set(self.depends[key])]
+            for key in stale:
+                del self.entries[key]
+                del self.sizes[key]
+                del self.depends[key]
+                self.pinned.discard(key)
+
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.depends.clear()
+            self.pinned.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self.entries),
+                'pinned': len(self.pinned & set(self.entries)),
+                'used_mb': self.used / 2**20,
+                'budget_mb': self.budget / 2**20,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def thread_stats(self) -> dict:
+        return {'hits': getattr(self._thread, 'hits', 0),
+                'misses': getattr(self._thread, 'misses', 0)}
+
+
+TABLES = TableCache()
+
+
+def cached(func=None, *, pin: bool = False, cache: TableCache = TABLES,
+           tables: list[str] = None):
+
+    # Memoize a loader in the shared table cache, keyed on its arguments and
+    # on the version of the source tables it reads (all of them if unknown)
+    if func is None:
+        return functools.partial(cached, pin=pin, cache=cache, tables=tables)
+
+    tables = None if tables is None else tuple(sorted(set(tables)))
+
+    # Pages run as scripts by streamlit and imported as modules by the
+    # warm-up share entries, whatever path they were loaded from
+    filename = os.path.realpath(func.__code__.co_filename)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (filename, func.__qualname__, version(tables), freeze(args), freeze(kwargs))
+        return cache.get(key, lambda: func(*args, **kwargs), pin, tables)
+
+    return wrapper
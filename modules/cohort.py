@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+
+from modules.cache import cached, sizeof
+from modules.data import load_table
+from modules.perf import timed
+
+TOP_DIAGNOSES = 50
+FIELDS = ['GENDER', 'FIRST_CAREUNIT', 'YEAR', 'DIAGNOSIS']
+TABLES = ['ADMISSIONS', 'PATIENTS', 'ICUSTAYS', 'DIAGNOSES_ICD', 'D_ICD_DIAGNOSES']
+
+
+class Cohort:
+
+    # Set of admissions as a packed bit array over the admissions of a
+    # CohortIndex, combined with & | ~ without unpacking
+
+    def __init__(self, index: 'CohortIndex', bits: np.ndarray):
+        self.index, self.bits = index, bits
+
+    def __and__(self, other: 'Cohort') -> 'Cohort':
+        return Cohort(self.index, self.bits & other.bits)
+
+    def __or__(self, other: 'Cohort') -> 'Cohort':
+        return Cohort(self.index, self.bits | other.bits)
+
+    def __invert__(self) -> 'Cohort':
+        return Cohort(self.index, ~self.bits & self.index.valid)
+
+    def __len__(self) -> int:
+        return int(np.bitwise_count(self.bits).sum())
+
+    def mask(self) -> np.ndarray:
+        return np.unpackbits(self.bits, count=len(self.index.hadm)).astype(bool)
+
+    def hadm_ids(self) -> np.ndarray:
+        return self.index.hadm[self.mask()]
+
+    def subject_ids(self) -> np.ndarray:
+        return np.unique(self.index.subject[self.mask()])
+
+    def take(self, data: pd.DataFrame, key: str = 'HADM_ID') -> pd.DataFrame:
+
+        # Membership of every row looked up in one gather from a dense
+        # table over the ids, rows with a missing or unknown id are dropped
+        ids = self.hadm_ids() if key == 'HADM_ID' else self.subject_ids()
+        values = pd.to_numeric(data[key]).to_numpy(dtype=float, na_value=-1)
+        lookup = np.zeros(int(max(ids.max(initial=0), values.max(initial=0))) + 2, dtype=bool)
+        lookup[ids] = True
+
+        # Missing ids read the last slot, which is never set
+        return data[lookup[np.where(values >= 0, values, -1).astype(np.int64)]]
+
+
+class CohortIndex:
+
+    # Admissions sorted by HADM_ID with one packed bitmap per value of every
+    # field, an admission is in the bitmap of each value it has
+
+    def __init__(self, admissions: pd.DataFrame, values: dict[str, pd.DataFrame],
+                 labels: dict[str, dict] = None):
+
+        admissions = admissions.sort_values('HADM_ID', ignore_index=True)
+        self.hadm = admissions['HADM_ID'].to_numpy(dtype=np.int64)
+        self.subject = admissions['SUBJECT_ID'].to_numpy(dtype=np.int64)
+        self.labels = labels or {}
+        self.valid = np.packbits(np.ones(len(self.hadm), dtype=bool))
+
+        # values[field] has a HADM_ID and a VALUE per (admission, value) pair
+        self.bitmaps = {}
+        for field, pairs in values.items():
+            pairs = pairs.dropna()
+            rows = np.searchsorted(self.hadm, pairs['HADM_ID'].to_numpy(dtype=np.int64))
+            rows = np.minimum(rows, len(self.hadm) - 1)
+            known = self.hadm[rows] == pairs['HADM_ID'].to_numpy(dtype=np.int64)
+            codes, uniques = pd.factorize(pairs['VALUE'][known], sort=True)
+            rows = rows[known]
+
+            self.bitmaps[field] = {}
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            for i, value in enumerate(uniques):
+                mask = np.zeros(len(self.hadm), dtype=bool)
+                mask[rows[order[bounds[i]:bounds[i + 1]]]] = True
+                self.bitmaps[field][value] = np.packbits(mask)
+
+    def __sizeof__(self) -> int:
+        return sizeof([self.hadm, self.subject]) \
+            + sum(bits.nbytes for bitmaps in self.bitmaps.values() for bits in bitmaps.values())
+
+    def values(self, field: str) -> list:
+        return list(self.bitmaps[field])
+
+    def all(self) -> Cohort:
+        return Cohort(self, self.valid.copy())
+
+    def none(self) -> Cohort:
+        return Cohort(self, np.zeros_like(self.valid))
+
+    def any_of(self, field: str, values: list) -> Cohort:
+
+        bitmaps = [self.bitmaps[field][value] for value in values if value in self.bitmaps[field]]
+        if not bitmaps:
+            return self.none()
+
+        return Cohort(self, np.bitwise_or.reduce(bitmaps))
+
+    def select(self, criteria: dict) -> Cohort:
+
+        # Any of the values within a field, all of the fields, and none of
+        # the EXCLUDE diagnoses
+        cohort = self.all()
+        for field, values in criteria.items():
+            if field in FIELDS and values:
+                cohort = cohort & self.any_of(field, values)
+        if criteria.get('EXCLUDE'):
+            cohort = cohort & ~self.any_of('DIAGNOSIS', criteria['EXCLUDE'])
+
+        return cohort
+
+
+def build_cohort_index(top: int = TOP_DIAGNOSES) -> CohortIndex:
+
+    admissions = load_table('ADMISSIONS', columns=['SUBJECT_ID', 'HADM_ID', 'ADMITTIME'])
+    patients = load_table('PATIENTS', columns=['SUBJECT_ID', 'GENDER'])
+    icustays = load_table('ICUSTAYS', columns=['HADM_ID', 'FIRST_CAREUNIT'])
+    diagnoses = load_table('DIAGNOSES_ICD', columns=['HADM_ID', 'ICD9_CODE'])
+    titles = load_table('D_ICD_DIAGNOSES', columns=['ICD9_CODE', 'SHORT_TITLE'])
+
+    gender = pd.merge(admissions[['HADM_ID', 'SUBJECT_ID']], patients, on='SUBJECT_ID')
+
+    # Only the most frequent diagnoses get a bitmap
+    diagnoses = diagnoses.dropna().drop_duplicates()
+    codes = diagnoses['ICD9_CODE'].astype(str)
+    diagnoses = diagnoses[codes.isin(codes.value_counts().index[:top])]
+    titles = titles.dropna().astype(str).set_index('ICD9_CODE')['SHORT_TITLE']
+
+    values = {
+        'GENDER': gender[['HADM_ID']].assign(VALUE=gender['GENDER'].astype(str)),
+        'FIRST_CAREUNIT': icustays[['HADM_ID']].assign(VALUE=icustays['FIRST_CAREUNIT'].astype(str)),
+        'YEAR': admissions[['HADM_ID']].assign(VALUE=admissions['ADMITTIME'].dt.year),
+        'DIAGNOSIS': diagnoses[['HADM_ID']].assign(VALUE=diagnoses['ICD9_CODE'].astype(str)),
+    }
+    labels = {'DIAGNOSIS': titles[titles.index.isin(diagnoses['ICD9_CODE'].astype(str))].to_dict()}
+
+    return CohortIndex(admissions.dropna(subset=['HADM_ID']), values, labels)
+
+
+@timed('load')
+@cached(pin=True, tables=TABLES)
+def get_cohort_index() -> CohortIndex:
+    return build_cohort_index()
+
+
+@timed('aggregate')
+def select(criteria: dict | None) -> Cohort | None:
+
+    # None stands for every admission, nothing to filter
+    if not criteria or not any(criteria.values()):
+        return None
+
+    return get_cohort_index().select(criteria)
+
+
+def in_cohort(data: pd.DataFrame, criteria: dict | None, key: str = 'HADM_ID') -> pd.DataFrame:
+
+    cohort = select(criteria)
+
+    return data if cohort is None else cohort.take(data, key)
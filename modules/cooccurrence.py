@@ -0,0 +1,156 @@
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from modules.data import artifact_path, atomic_path, load_table
+
+COOCCURRENCE = 'COOCCURRENCE.npz'
+CATEGORIES = ['proc', 'drug']
+VERSION = 3
+
+
+def _incidence(rows: np.ndarray, cols: np.ndarray, shape: tuple) -> sp.csr_matrix:
+
+    # Duplicate (row, col) pairs are summed, i.e. the matrix holds row counts.
+    # Counts within a year stay far below 2**31, int32 halves the index
+    data = np.ones(len(rows), dtype=np.int32)
+
+    return sp.csr_matrix((data, (rows, cols)), shape=shape)
+
+
+def _events(events: pd.DataFrame, label: str, hadm: pd.Index) -> tuple:
+
+    # Admission position and label code of every event row
+    position = hadm.get_indexer(events['HADM_ID'])
+    keep = (position >= 0) & events[label].notnull().to_numpy()
+    codes, labels = pd.factorize(events[label][keep], sort=True)
+
+    return position[keep], codes, np.asarray(labels, dtype=str)
+
+
+def _lookup(values: np.ndarray, keys) -> np.ndarray:
+
+    # Positions of the keys found in a sorted array, missing keys are dropped
+    positions = np.searchsorted(values, keys)
+    found = positions < len(values)
+    found[found] = values[positions[found]] == np.asarray(keys)[found]
+
+    return positions[found]
+
+
+def build_cooccurrence() -> dict:
+
+    admissions = load_table('ADMISSIONS', columns=['HADM_ID', 'ADMITTIME'])
+    hadm = pd.Index(admissions['HADM_ID'])
+    year = admissions['ADMITTIME'].dt.year.to_numpy()
+
+    diagnosis = load_table('DIAGNOSES_ICD', columns=['HADM_ID', 'ICD9_CODE'])
+    diag_label = load_table('D_ICD_DIAGNOSES', columns=['ICD9_CODE', 'LONG_TITLE'])
+    diagnosis = pd.merge(diagnosis, diag_label, on='ICD9_CODE')
+
+    procs = load_table('PROCEDURES_ICD', columns=['HADM_ID', 'ICD9_CODE'])
+    procs_desc = load_table('D_ICD_PROCEDURES', columns=['ICD9_CODE', 'LONG_TITLE'])
+    procs = pd.merge(procs, procs_desc, on='ICD9_CODE')
+
+    drugs = load_table('PRESCRIPTIONS', columns=['HADM_ID', 'DRUG'])
+
+    index = {}
+
+    # One row per (admission year, diagnosis) pair that occurs in the data
+    adm, diag, index['diag_labels'] = _events(diagnosis, 'LONG_TITLE', hadm)
+    keys = year[adm].astype(np.int64) * len(index['diag_labels']) + diag
+    key_codes, keys = pd.factorize(keys, sort=True)
+    keys = np.asarray(keys)
+    index['years'] = keys // len(index['diag_labels'])
+    index['diags'] = keys % len(index['diag_labels'])
+
+    pairs = _incidence(key_codes, adm, (len(keys), len(hadm)))
+
+    # Admissions per (year, diagnosis), and the rows of each year ranked by
+    # that count for the disease picker
+    index['admissions'] = np.diff(pairs.indptr)
+    index['ranked'] = np.lexsort((index['diags'], -index['admissions'], index['years']))
+
+    # Sum over admissions of diagnosis rows x procedure (drug) rows, which is
+    # the row count of the diagnosis-procedure (drug) join per edge
+    for category, events, label in [('proc', procs, 'LONG_TITLE'), ('drug', drugs, 'DRUG')]:
+        adm, code, index[f'{category}_labels'] = _events(events, label, hadm)
+        counts = _incidence(adm, code, (len(hadm), len(index[f'{category}_labels'])))
+        index[category] = (pairs @ counts).tocsr()
+
+    save_cooccurrence(index)
+
+    return index
+
+
+def save_cooccurrence(index: dict):
+
+    arrays = {'version': np.array(VERSION)}
+    for key, value in index.items():
+        if sp.issparse(value):
+            arrays[f'{key}_indptr'] = value.indptr
+            arrays[f'{key}_indices'] = value.indices
+            arrays[f'{key}_data'] = value.data
+            arrays[f'{key}_shape'] = np.array(value.shape)
+        else:
+            arrays[key] = value
+
+    with atomic_path(artifact_path(COOCCURRENCE)) as tmp:
+        np.savez(tmp, **arrays)
+
+
+def load_cooccurrence() -> dict:
+
+    if not os.path.exists(artifact_path(COOCCURRENCE)):
+        return build_cooccurrence()
+
+    with np.load(artifact_path(COOCCURRENCE)) as arrays:
+        if 'version' not in arrays.files or arrays['version'] != VERSION:
+            return build_cooccurrence()
+        index = {key: arrays[key] for key in arrays.files 
+                 if key != 'version' and not key.startswith(tuple(CATEGORIES))}
+        for category in CATEGORIES:
+            index[f'{category}_labels'] = arrays[f'{category}_labels']
+            index[category] = sp.csr_matrix((arrays[f'{category}_data'],
+                                             arrays[f'{category}_indices'],
+                                             arrays[f'{category}_indptr']),
+                                            shape=tuple(arrays[f'{category}_shape']))
+
+    return index
+
+
+def get_edges(index: dict,
+              category: str,
+              diagnosis_desc: list[str],
+              yr: int,
+              top: int = 30) -> pd.DataFrame:
+
+    # Rows of the selected diagnoses in the given year
+    labels = index['diag_labels']
+    diags = _lookup(labels, np.asarray(diagnosis_desc, dtype=str))
+    keys = index['years'] * len(labels) + index['diags']
+    rows = _lookup(keys, yr * len(labels) + diags)
+
+    matrix = index[category][rows].tocoo()
+    edges = pd.DataFrame({
+        'source': labels[index['diags'][rows[matrix.row]]],
+        'target': index[f'{category}_labels'][matrix.col],
+        'weight': matrix.data,
+    })
+    edges['category'] = category
+    edges = edges.sort_values(by='weight', ascending=False)
+
+    return edges.head(top)
+
+
+def get_diagnoses(index: dict, yr: int) -> pd.Series:
+
+    # Admission count per diagnosis in a year, most frequent first
+    lo, hi = np.searchsorted(index['years'], [yr, yr + 1])
+    rows = index['ranked'][lo:hi]
+
+    return pd.Series(index['admissions'][rows],
+                     index=index['diag_labels'][index['diags'][rows]],
+                     name='ADMISSIONS')
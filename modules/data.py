@@ -0,0 +1,254 @@
+import argparse
+import contextlib
+import csv
+import gzip
+import json
+import os
+import shutil
+import threading
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+from modules.schema import SCHEMA, apply_schema, arrow_type
+
+load_dotenv('.env')
+DIR = os.getenv('DIR')
+CACHE = os.getenv('CACHE') or os.path.join(DIR or '.', 'parquet')
+
+# Tables also exported to Arrow IPC and memory-mapped, so that every
+# session and every server process on the host reads one copy of them
+SHARED = [name for name in os.getenv('SHARED_TABLES', 'ADMISSIONS,ICUSTAYS,PATIENTS,TRANSFERS,'
+                                     'D_ICD_DIAGNOSES,D_ICD_PROCEDURES,D_LABITEMS').split(',')
+          if name]
+
+ROWS_PER_FILE = 2_000_000
+ROWS_PER_GROUP = 128_000
+
+_lock = threading.Lock()
+_shared = {}
+
+
+def source_path(name: str) -> str:
+    return os.path.join(DIR, f'{name}.csv.gz')
+
+
+def table_path(name: str) -> str:
+    return os.path.join(CACHE, name)
+
+
+def artifact_path(name: str) -> str:
+    return os.path.join(CACHE, 'derived', name)
+
+
+def shared_path(name: str) -> str:
+    return os.path.join(CACHE, 'shared', f'{name}.arrow')
+
+
+@contextlib.contextmanager
+def atomic_path(path: str):
+
+    # Temporary file next to `path` for a writer, renamed over `path` in one
+    # step once the block completes and removed if it fails. It keeps the
+    # extension, which np.save and np.savez would otherwise append
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    root, ext = os.path.splitext(path)
+    tmp = f'{root}.{uuid.uuid4().hex}.tmp{ext}'
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def read_manifest(path: str) -> dict:
+
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(path: str, manifest: dict):
+    with atomic_path(path) as tmp:
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+
+def convert_table(name: str, replace: bool = False) -> str:
+
+    # Stream the gzip CSV into row groups of typed parquet files
+    src = source_path(name)
+    with gzip.open(src, 'rt') as f:
+        columns = next(csv.reader(f))
+
+    types = {}
+    for col in columns:
+        types[col] = arrow_type(name, col.upper())
+    reader = pv.open_csv(src,
+                         read_options=pv.ReadOptions(block_size=16 << 20),
+                         convert_options=pv.ConvertOptions(column_types=types,
+                                                           strings_can_be_null=True))
+
+    target = table_path(name)
+    tmp = f'{target}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(tmp)
+
+    schema = pa.schema([(col.upper(), types[col]) for col in columns])
+    part, rows, writer = 0, 0, None
+    for batch in reader:
+        if writer is None or rows >= ROWS_PER_FILE:
+            if writer is not None:
+                writer.close()
+            writer = pq.ParquetWriter(os.path.join(tmp, f'part-{part:05d}.parquet'), schema)
+            part, rows = part + 1, 0
+        writer.write_batch(batch.rename_columns(schema.names), row_group_size=ROWS_PER_GROUP)
+        rows += batch.num_rows
+    if writer is None:
+        pq.write_table(schema.empty_table(), os.path.join(tmp, 'part-00000.parquet'))
+    else:
+        writer.close()
+
+    # Every conversion is a new version directory and the table path is a
+    # symlink to the current one, swapped in a single rename, so readers
+    # always find a complete table. Without replace, a table another
+    # process linked first is kept
+    version = f'{target}.{uuid.uuid4().hex}'
+    os.rename(tmp, version)
+    if not replace:
+        try:
+            os.symlink(os.path.basename(version), target)
+        except FileExistsError:
+            shutil.rmtree(version, ignore_errors=True)
+        return target
+
+    previous = os.path.realpath(target) if os.path.islink(target) else None
+    if os.path.isdir(target) and not os.path.islink(target):
+        # A directory from before the versioned layout is moved aside once
+        previous = f'{target}.{uuid.uuid4().hex}.old'
+        os.rename(target, previous)
+
+    link = f'{version}.link'
+    os.symlink(os.path.basename(version), link)
+    os.replace(link, target)
+    if previous is not None:
+        shutil.rmtree(previous, ignore_errors=True)
+
+    return target
+
+
+def _sort_dictionary(array: pa.DictionaryArray) -> pa.DictionaryArray:
+
+    # Same values with the dictionary in lexical order, the indices are
+    # mapped through the inverse of the sort permutation
+    order = pc.array_sort_indices(array.dictionary)
+    rank = pc.array_sort_indices(order).cast(array.type.index_type)
+
+    return pa.DictionaryArray.from_arrays(pc.take(rank, array.indices), array.dictionary.take(order))
+
+
+def export_shared(name: str) -> str:
+
+    # One uncompressed batch with one dictionary per column, so every column
+    # maps to a single buffer that pandas can view without copying. Sorted
+    # dictionaries load as categories load_table does not need to reorder
+    table = ds.dataset(table_path(name), format='parquet').to_table()
+    table = table.unify_dictionaries().combine_chunks()
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field, _sort_dictionary(table.column(i).combine_chunks()))
+
+    target = shared_path(name)
+    with atomic_path(target) as tmp:
+        with ipc.new_file(tmp, table.schema) as writer:
+            writer.write_table(table)
+
+    return target
+
+
+def open_shared(name: str) -> pa.Table | None:
+
+    # Read-only view of an exported table, its buffers point into the memory
+    # map and the pages are shared through the OS page cache. A new export
+    # replaces the file, the mtime tells the open map is stale
+    path = shared_path(name)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    entry = _shared.get(name)
+    if entry is None or entry[0] != mtime:
+        with _lock:
+            entry = _shared.get(name)
+            if entry is None or entry[0] != mtime:
+                entry = (mtime, ipc.open_file(pa.memory_map(path)).read_all())
+                _shared[name] = entry
+
+    return entry[1]
+
+
+def get_table(name: str) -> ds.Dataset:
+
+    shared = open_shared(name)
+    if shared is not None:
+        return ds.dataset(shared)
+
+    path = table_path(name)
+    if not os.path.isdir(path):
+        with _lock:
+            if not os.path.isdir(path):
+                os.makedirs(CACHE, exist_ok=True)
+                convert_table(name)
+
+    return ds.dataset(path, format='parquet')
+
+
+def load_table(name: str,
+               columns: list[str] = None,
+               filter: ds.Expression = None) -> pd.DataFrame:
+
+    table = get_table(name).to_table(columns=columns, filter=filter)
+
+    # Separate blocks per column, numeric columns of a shared table stay
+    # views of the memory map
+    return apply_schema(table.to_pandas(split_blocks=True), name)
+
+
+def memory_report(names: list[str] = None) -> pd.DataFrame:
+
+    # Footprint of every column with the registry dtypes against a plain
+    # read_csv of the same file (object strings, int64/float64)
+    rows = []
+    for name in names or SCHEMA:
+        data = load_table(name)
+        default = pd.read_csv(source_path(name), compression='gzip')
+        compact_mb = data.memory_usage(deep=True).sum() / 2**20
+        default_mb = default.memory_usage(deep=True).sum() / 2**20
+        rows.append({
+            'TABLE': name,
+            'ROWS': len(data),
+            'COMPACT_MB': round(compact_mb, 2),
+            'DEFAULT_MB': round(default_mb, 2),
+            'SAVED_PCT': round(100 * (1 - compact_mb / default_mb), 1) if default_mb else 0.0,
+        })
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Memory footprint of the MIMIC tables')
+    parser.add_argument('tables', nargs='*', help='tables to report, all by default')
+    args = parser.parse_args()
+
+    print(memory_report(args.tables).to_string(index=False))
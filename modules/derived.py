@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+SECONDS_PER_DAY = 86400
+
+
+def _seconds(end: pd.Series, start: pd.Series) -> np.ndarray:
+
+    # Elapsed seconds between two datetime columns, NaN where either is NaT
+    end = end.to_numpy(dtype='datetime64[s]')
+    start = start.to_numpy(dtype='datetime64[s]')
+
+    return (end - start) / np.timedelta64(1, 's')
+
+
+def add_age(data: pd.DataFrame,
+            dob: str = 'DOB',
+            dod: str = 'DOD',
+            expire: str = 'EXPIRE_FLAG',
+            at: str = 'INTIME',
+            column: str = 'AGE') -> pd.DataFrame:
+
+    # Age at death for expired patients, otherwise age at the `at` timestamp,
+    # in whole years of 365 days
+    reference = data[dod].where(data[expire].astype(bool), data[at])
+    days = np.floor(_seconds(reference, data[dob]) / SECONDS_PER_DAY)
+    age = days // 365
+
+    if not np.isnan(age).any():
+        age = age.astype('int64')
+
+    return data.assign(**{column: age})
+
+
+def add_los(data: pd.DataFrame,
+            start: str = 'INTIME',
+            end: str = 'OUTTIME',
+            column: str = 'LOS') -> pd.DataFrame:
+
+    # Length of stay in fractional days, keeping any value already recorded
+    los = _seconds(data[end], data[start]) / SECONDS_PER_DAY
+
+    los = pd.Series(los, index=data.index)
+    if column in data:
+        los = data[column].fillna(los)
+
+    return data.assign(**{column: los})
@@ -0,0 +1,217 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+from modules import aggregates, cooccurrence, labs, pathways, sources
+from modules.cache import TABLES
+from modules.data import (SHARED, artifact_path, convert_table, export_shared, get_table,
+                          shared_path, source_path, table_path)
+from modules.schema import SCHEMA
+from modules.sources import fingerprint, load_manifest, save_manifest
+
+load_dotenv('.env')
+# Seconds between two looks at the manifest from the app, 0 turns it off
+CHECK_SECONDS = float(os.getenv('SOURCE_CHECK_SECONDS', 10))
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_checked = 0.0
+
+# Every derived artifact the pages load, with its builder, the files it
+# writes and the tables it is computed from
+ARTIFACTS = {
+    'cooccurrence': {
+        'build': cooccurrence.build_cooccurrence,
+        'files': [cooccurrence.COOCCURRENCE],
+        'tables': ['ADMISSIONS', 'DIAGNOSES_ICD', 'D_ICD_DIAGNOSES', 'PROCEDURES_ICD',
+                   'D_ICD_PROCEDURES', 'PRESCRIPTIONS'],
+    },
+    'admission_counts': {
+        'build': aggregates.build_admission_counts,
+        'files': [f'{aggregates.ICU_ADMISSIONS}.npz'],
+        'tables': ['ICUSTAYS'],
+    },
+    'transfer_counts': {
+        'build': aggregates.build_transfer_counts,
+        'files': [f'{aggregates.ICU_TRANSFERS}.npz'],
+        'tables': ['TRANSFERS'],
+    },
+    'pathways': {
+        'build': pathways.build_sequences,
+        'files': [pathways.PATHWAYS],
+        'tables': ['TRANSFERS'],
+    },
+    'lab_catalog': {
+        'build': labs.build_lab_catalog,
+        'files': [labs.SORTED, labs.CATALOG],
+        'tables': ['LABEVENTS', 'PATIENTS'],
+    },
+}
+
+
+def tables_of(*artifacts: str) -> list[str]:
+    return sorted({table for name in artifacts for table in ARTIFACTS[name]['tables']})
+
+
+def dependents(table: str) -> list[str]:
+    return [name for name, artifact in ARTIFACTS.items() if table in artifact['tables']]
+
+
+def _size(path: str) -> int:
+
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, file))
+                   for root, _, files in os.walk(path) for file in files)
+
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def build_table(name: str, force: bool = False) -> dict:
+
+    # A forced conversion swaps the new files in, readers never see the
+    # table missing
+    start = time.perf_counter()
+    if force or not os.path.isdir(table_path(name)):
+        convert_table(name, replace=force)
+    if name in SHARED and (force or not os.path.exists(shared_path(name))):
+        export_shared(name)
+
+    return {
+        'rows': get_table(name).count_rows(),
+        'bytes': _size(table_path(name)),
+        'shared_bytes': _size(shared_path(name)),
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def build_artifact(name: str) -> dict:
+
+    # Builders write their files themselves, only the timing goes back to
+    # the parent process
+    start = time.perf_counter()
+    ARTIFACTS[name]['build']()
+
+    return {
+        'files': ARTIFACTS[name]['files'],
+        'tables': ARTIFACTS[name]['tables'],
+        'bytes': sum(_size(artifact_path(file)) for file in ARTIFACTS[name]['files']),
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+
+
+def build(artifacts: list[str] = None, workers: int = None, force: bool = False,
+          tables: list[str] = None) -> dict:
+
+    artifacts = list(ARTIFACTS) if artifacts is None else artifacts
+    if tables is None:
+        tables = sorted(SCHEMA) if set(artifacts) == set(ARTIFACTS) else tables_of(*artifacts)
+
+    manifest = load_manifest()
+    manifest.setdefault('tables', {})
+    manifest.setdefault('artifacts', {})
+    manifest.setdefault('sources', {})
+
+    # Tables are independent, then every artifact only reads finished tables
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {name: pool.submit(build_table, name, force) for name in tables}
+        for name, future in futures.items():
+            manifest['tables'][name] = future.result()
+            manifest['sources'][name] = {**fingerprint(name, manifest['sources'].get(name)),
+                                         'artifacts': dependents(name)}
+            logger.info('table    %-20s %8.1fs', name, manifest['tables'][name]['seconds'])
+
+        futures = {name: pool.submit(build_artifact, name) for name in artifacts}
+        for name, future in futures.items():
+            manifest['artifacts'][name] = future.result()
+            logger.info('artifact %-20s %8.1fs', name, manifest['artifacts'][name]['seconds'])
+
+    manifest['source'] = os.path.abspath(os.getenv('DIR') or '.')
+    manifest['built_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    save_manifest(manifest)
+
+    return manifest
+
+
+def update(workers: int = None) -> list[str]:
+
+    # Rebuilds only the converted tables whose source file content changed
+    # since it was fingerprinted, and the built artifacts computed from them
+    manifest = load_manifest()
+    recorded = manifest.get('sources', {})
+    current = {name: {**fingerprint(name, recorded.get(name)), 'artifacts': dependents(name)}
+               for name in SCHEMA if os.path.exists(source_path(name))}
+    changed = sorted(name for name in current
+                     if name in recorded and current[name]['sha256'] != recorded[name]['sha256'])
+
+    tables = [name for name in changed if os.path.isdir(table_path(name))]
+    artifacts = [name for name, artifact in ARTIFACTS.items()
+                 if set(artifact['tables']) & set(changed)
+                 and all(os.path.exists(artifact_path(file)) for file in artifact['files'])]
+    if tables or artifacts:
+        manifest = build(artifacts, workers, force=True, tables=tables)
+
+    # Tables never fingerprinted are recorded as they are now
+    if current != manifest.get('sources'):
+        manifest['sources'] = {**manifest.get('sources', {}), **current}
+        save_manifest(manifest)
+
+    return changed
+
+
+def refresh() -> list[str]:
+
+    # Called on every rerun, reads the manifest at most every CHECK_SECONDS.
+    # Rebuilds are left to `etl update`, the app only drops the cached
+    # results of the tables it rebuilt
+    global _checked
+    if CHECK_SECONDS <= 0 or time.monotonic() - _checked < CHECK_SECONDS:
+        return []
+    if not _lock.acquire(blocking=False):
+        return []
+
+    try:
+        _checked = time.monotonic()
+        changed = sources.reload()
+        if changed:
+            TABLES.invalidate(changed)
+    finally:
+        _lock.release()
+
+    return changed
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Build the parquet tables and derived artifacts')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('build', help='convert the tables and build the artifacts')
+    command.add_argument('artifacts', nargs='*',
+                         help=f'artifacts to build, all by default: {", ".join(ARTIFACTS)}')
+    command.add_argument('--workers', type=int, default=None, help='worker processes')
+    command.add_argument('--force', action='store_true', help='convert the tables again')
+
+    command = commands.add_parser('update', help='rebuild what depends on changed source files')
+    command.add_argument('--workers', type=int, default=None, help='worker processes')
+
+    commands.add_parser('status', help='print the manifest')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.command == 'build':
+        unknown = set(args.artifacts) - set(ARTIFACTS)
+        if unknown:
+            parser.error(f'unknown artifacts: {", ".join(sorted(unknown))}')
+        build(args.artifacts or None, args.workers, args.force)
+    elif args.command == 'update':
+        changed = update(args.workers)
+        print(f'changed: {", ".join(changed) or "nothing"}')
+    else:
+        print(json.dumps(load_manifest(), indent=2))
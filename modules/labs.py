@@ -0,0 +1,144 @@
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from modules.data import artifact_path, atomic_path, get_table
+
+LAB_COLUMNS = ['SUBJECT_ID', 'HADM_ID', 'ITEMID', 'VALUENUM', 'VALUEUOM']
+GENDERS = ['F', 'M']
+QUANTILES = {'Q05': .05, 'Q25': .25, 'Q50': .5, 'Q75': .75, 'Q95': .95}
+SEED = 2100
+GROUP_ROWS = 1 << 16
+WHISKER = 1.5
+MAX_OUTLIERS = 200
+
+SORTED = 'LABEVENTS_BY_ITEM.parquet'
+CATALOG = 'LAB_CATALOG.parquet'
+
+
+def _write(table: pa.Table, name: str, **kwargs):
+    with atomic_path(artifact_path(name)) as tmp:
+        pq.write_table(table, tmp, **kwargs)
+
+
+def build_lab_catalog() -> pd.DataFrame:
+
+    labs = get_table('LABEVENTS').to_table(
+        columns=LAB_COLUMNS,
+        filter=ds.field('HADM_ID').is_valid() & ds.field('VALUENUM').is_valid()
+    )
+
+    # Fixed-seed rank drawn in scan order, so sorting by it below gives every
+    # ITEMID x GENDER stratum a reproducible random order
+    rng = np.random.default_rng(SEED)
+    labs = labs.append_column('RANK', pa.array(rng.random(labs.num_rows)))
+
+    patients = get_table('PATIENTS').to_table(columns=['SUBJECT_ID', 'GENDER'],
+                                              filter=ds.field('GENDER').isin(GENDERS))
+    # Row groups carry their own string dictionaries, which the join
+    # cannot combine
+    labs = labs.unify_dictionaries().join(patients.unify_dictionaries(), 'SUBJECT_ID',
+                                          join_type='inner')
+
+    # Arrow cannot sort dictionary columns, so gender is sorted as a string
+    gender = labs.schema.get_field_index('GENDER')
+    labs = labs.set_column(gender, 'GENDER', labs['GENDER'].cast(pa.string()))
+    labs = labs.sort_by([('ITEMID', 'ascending'),
+                         ('GENDER', 'ascending'),
+                         ('RANK', 'ascending')])
+    labs = labs.set_column(gender, 'GENDER', labs['GENDER'].dictionary_encode())
+    _write(labs, SORTED, row_group_size=GROUP_ROWS)
+
+    keys = labs.select(['ITEMID', 'GENDER', 'VALUENUM']).to_pandas()
+    counts = keys.groupby(['ITEMID', 'GENDER'], observed=False).size().unstack(fill_value=0)
+    counts = counts.reindex(columns=GENDERS, fill_value=0)
+
+    catalog = counts.add_prefix('ROWS_')
+    catalog.insert(0, 'ROWS', counts.sum(axis=1))
+
+    quantiles = keys.groupby('ITEMID')['VALUENUM'].quantile(list(QUANTILES.values()))
+    quantiles = quantiles.unstack()
+    quantiles.columns = list(QUANTILES)
+    catalog = catalog.join(quantiles)
+
+    # Row and row group offsets of each ITEMID in the sorted readings
+    catalog['ROW_START'] = catalog['ROWS'].cumsum() - catalog['ROWS']
+    catalog['ROW_END'] = catalog['ROW_START'] + catalog['ROWS']
+    catalog['GROUP_START'] = catalog['ROW_START'] // GROUP_ROWS
+    catalog['GROUP_END'] = (catalog['ROW_END'] - 1) // GROUP_ROWS + 1
+
+    catalog = catalog.reset_index()
+    catalog.columns.name = None
+    _write(pa.Table.from_pandas(catalog, preserve_index=False), CATALOG)
+
+    return catalog
+
+
+def load_lab_catalog() -> pd.DataFrame:
+
+    if not os.path.exists(artifact_path(CATALOG)):
+        return build_lab_catalog()
+
+    return pq.read_table(artifact_path(CATALOG)).to_pandas()
+
+
+def read_lab_sample(entry: dict,
+                    sampling_size: float = 100,
+                    columns: list[str] = None) -> pd.DataFrame:
+
+    # Rows of a stratum are in rank order, so its first k rows are the
+    # deterministic sample of size k
+    ranges = []
+    start = int(entry['ROW_START'])
+    for gender in GENDERS:
+        rows = int(entry[f'ROWS_{gender}'])
+        ranges.append((start, start + math.ceil(rows * sampling_size / 100)))
+        start += rows
+
+    readings = pq.ParquetFile(artifact_path(SORTED))
+    parts = []
+    for lo, hi in ranges:
+        if hi <= lo:
+            continue
+        groups = range(lo // GROUP_ROWS, (hi - 1) // GROUP_ROWS + 1)
+        table = readings.read_row_groups(groups, columns=columns)
+        parts.append(table.slice(lo - groups[0] * GROUP_ROWS, hi - lo))
+
+    return pa.concat_tables(parts).to_pandas()
+
+
+def box_stats(data: pd.DataFrame,
+              value: str = 'VALUENUM',
+              by: str = 'GENDER',
+              max_outliers: int = MAX_OUTLIERS) -> pd.DataFrame:
+
+    # Tukey box of every group, as plotly would compute it in the browser,
+    # with the whiskers at the furthest readings inside the fences
+    rows = []
+    for group, values in data.groupby(by, observed=True)[value]:
+        values = np.sort(values.dropna().to_numpy())
+        if not len(values):
+            continue
+
+        q1, median, q3 = np.quantile(values, [.25, .5, .75])
+        low, high = q1 - WHISKER * (q3 - q1), q3 + WHISKER * (q3 - q1)
+        inside = values[(values >= low) & (values <= high)]
+        outliers = values[(values < low) | (values > high)]
+
+        # Evenly spaced over the sorted outliers, so the extremes are always
+        # kept and the sample is the same on every rerun
+        if len(outliers) > max_outliers:
+            outliers = outliers[np.linspace(0, len(outliers) - 1, max_outliers).round().astype(int)]
+
+        rows.append({by: str(group), 'N': len(values), 'MEAN': values.mean(),
+                     'Q1': q1, 'MEDIAN': median, 'Q3': q3,
+                     'LOWERFENCE': inside[0], 'UPPERFENCE': inside[-1],
+                     'OUTLIERS': outliers})
+
+    return pd.DataFrame(rows, columns=[by, 'N', 'MEAN', 'Q1', 'MEDIAN', 'Q3',
+                                       'LOWERFENCE', 'UPPERFENCE', 'OUTLIERS'])
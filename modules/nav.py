@@ -1,6 +1,21 @@
+from collections import deque
+
+import pandas as pd
 import streamlit as st
 
-def sidebar():
+from modules import perf
+from modules.cohort import get_cohort_index, select
+from modules.etl import refresh
+
+HISTORY = 50
+COHORT_KEYS = ['cohort_enabled', 'cohort_gender', 'cohort_units', 'cohort_years',
+               'cohort_diagnoses', 'cohort_exclude']
+
+def sidebar(cohort: bool = False):
+    # stages of this rerun are recorded until diagnostics() is called,
+    # `cohort` for pages that apply the cohort filter
+    perf.begin(memory=st.session_state.get('diagnostics', False))
+
     # builds the sidebar menu
     with st.sidebar:
         st.page_link('app.py', label='Home')
@@ -9,4 +24,92 @@ def sidebar():
         st.page_link('pages/viz_3.py', label='Visualization #3')
         st.page_link('pages/viz_4.py', label='Visualization #4')
         st.page_link('pages/viz_5.py', label='Visualization #5')
-        st.page_link('pages/about.py', label='About')
\ No newline at end of file
+        st.page_link('pages/about.py', label='About')
+        cohort_filter(cohort)
+        st.toggle('Diagnostics', key='diagnostics')
+
+    # picks up tables rebuilt by `python -m modules.etl update`
+    with perf.stage('refresh', 'load'):
+        changed = refresh()
+    if changed:
+        st.toast(f'Reloaded data for {", ".join(changed)}')
+
+def cohort_filter(enabled: bool = True):
+    # one cohort definition for every page, widget values are written back
+    # so that they survive switching pages
+    for key in COHORT_KEYS:
+        if key in st.session_state:
+            st.session_state[key] = st.session_state[key]
+
+    with st.expander('Cohort'):
+        # pages that ignore the cohort keep it for the others without
+        # offering the controls
+        if not enabled:
+            st.caption('Not applied on this page')
+            return
+
+        # the index is only built once the filter is turned on
+        if not st.toggle('Filter admissions', key='cohort_enabled'):
+            st.caption('All admissions')
+            st.session_state['cohort'] = None
+            return
+
+        index = get_cohort_index()
+        titles = index.labels.get('DIAGNOSIS', {})
+        years = [int(yr) for yr in index.values('YEAR')] or [0]
+        first, last = min(years), max(years)
+
+        gender = st.multiselect('Gender', index.values('GENDER'), key='cohort_gender')
+        units = st.multiselect('First care unit', sorted(index.values('FIRST_CAREUNIT')),
+                               key='cohort_units')
+        st.session_state.setdefault('cohort_years', (first, last))
+        yr_start, yr_end = st.slider('Admission year', min_value=first, max_value=last,
+                                     key='cohort_years')
+        diagnoses = st.multiselect('With any of the diagnoses', index.values('DIAGNOSIS'),
+                                   format_func=lambda code: f'{code} {titles.get(code, "")}',
+                                   key='cohort_diagnoses')
+        exclude = st.multiselect('Without the diagnoses', index.values('DIAGNOSIS'),
+                                 format_func=lambda code: f'{code} {titles.get(code, "")}',
+                                 key='cohort_exclude')
+
+        criteria = {
+            'GENDER': gender,
+            'FIRST_CAREUNIT': units,
+            'YEAR': list(range(yr_start, yr_end + 1)) if (yr_start, yr_end) != (first, last) else [],
+            'DIAGNOSIS': diagnoses,
+            'EXCLUDE': exclude,
+        }
+        cohort = select(criteria)
+        if cohort is None:
+            st.caption('All admissions')
+        else:
+            st.caption(f'{len(cohort):,} of {len(index.hadm):,} admissions, '
+                       f'applied to lab readings, stays and pathways')
+
+    st.session_state['cohort'] = criteria if cohort is not None else None
+
+def cohort() -> dict | None:
+    # criteria of the sidebar cohort, None when every admission is included
+    return st.session_state.get('cohort')
+
+def diagnostics():
+    # closes the rerun record and shows it in the sidebar when enabled
+    run = perf.end()
+    if run is None:
+        return
+
+    runs = st.session_state.setdefault('perf_runs', deque(maxlen=HISTORY))
+    runs.append(run)
+
+    if not st.session_state.get('diagnostics'):
+        return
+
+    with st.sidebar.expander('Diagnostics', expanded=True):
+        st.caption(f"{run['page']}: {run['seconds'] * 1000:,.0f} ms, "
+                   f"cache {run['cache']['used_mb']:,.0f} / {run['cache']['budget_mb']:,.0f} MB")
+        stages = pd.DataFrame(run['stages'], columns=['stage', 'kind', 'depth', 'seconds',
+                                                      'peak_mb', 'rss_mb', 'hits', 'misses'])
+        stages['stage'] = ['  ' * depth + name for name, depth in zip(stages['stage'], stages['depth'])]
+        st.dataframe(stages.drop(columns='depth'), hide_index=True)
+        st.download_button('Export JSON lines', perf.to_jsonl(runs),
+                           file_name='perf.jsonl', mime='application/jsonl')
@@ -0,0 +1,132 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from modules.data import artifact_path, atomic_path, load_table
+
+PATHWAYS = 'PATHWAYS.parquet'
+WARD = 'WARD'
+DISCHARGE = 'DISCHARGE'
+OTHER = 'Other'
+MAX_STAGES = 6
+
+
+def build_sequences() -> pd.DataFrame:
+
+    data = load_table('TRANSFERS', columns=['HADM_ID', 'EVENTTYPE', 'CURR_CAREUNIT', 'INTIME'])
+    data = data.dropna(subset=['HADM_ID', 'INTIME'])
+    data = data.sort_values(['HADM_ID', 'INTIME'], kind='stable')
+
+    # Location after every event: a care unit, a ward outside the ICUs, or
+    # discharge at the end of the admission
+    unit = data['CURR_CAREUNIT'].astype(str).where(data['CURR_CAREUNIT'].notnull(), WARD)
+    unit = unit.where(data['EVENTTYPE'].astype(str) != 'discharge', DISCHARGE)
+
+    # Consecutive events in the same location are a single stage
+    hadm = data['HADM_ID']
+    changed = (hadm != hadm.shift()) | (unit != unit.shift())
+    data = data[changed].assign(UNIT=unit[changed])
+
+    sequences = pd.DataFrame({
+        'HADM_ID': data['HADM_ID'].astype('int32'),
+        'YEAR': data.groupby('HADM_ID')['INTIME'].transform('min').dt.year.astype('int16'),
+        'STEP': data.groupby('HADM_ID').cumcount().astype('int16'),
+        'UNIT': data['UNIT'].astype('category'),
+    }).reset_index(drop=True)
+
+    with atomic_path(artifact_path(PATHWAYS)) as tmp:
+        pq.write_table(pa.Table.from_pandas(sequences, preserve_index=False), tmp)
+
+    return sequences
+
+
+def load_sequences() -> pd.DataFrame:
+
+    if not os.path.exists(artifact_path(PATHWAYS)):
+        return build_sequences()
+
+    return pd.read_parquet(artifact_path(PATHWAYS))
+
+
+def _rank(groups: np.ndarray, count: np.ndarray) -> np.ndarray:
+
+    # Position of every item within its group, most frequent first
+    order = np.lexsort((-count, groups))
+    groups = groups[order]
+    start = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    sizes = np.diff(np.r_[start, len(order)])
+
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - np.repeat(start, sizes)
+
+    return rank
+
+
+def build_trie(sequences: pd.DataFrame,
+               yr: int | tuple = None,
+               stages: int = MAX_STAGES,
+               top: int = 5) -> pd.DataFrame:
+
+    # Admissions in a single year or an inclusive (start, end) range of years
+    if yr is not None:
+        yr_start, yr_end = yr if isinstance(yr, (tuple, list)) else (yr, yr)
+        sequences = sequences[sequences['YEAR'].between(yr_start, yr_end)]
+    sequences = sequences[sequences['STEP'] < stages]
+
+    units = sequences['UNIT'].cat.codes.to_numpy()
+    labels = np.asarray(list(sequences['UNIT'].cat.categories) + [OTHER], dtype=str)
+    other = len(labels) - 1
+    adm, hadm = pd.factorize(sequences['HADM_ID'])
+    step = sequences['STEP'].to_numpy()
+
+    # Trie node each admission has reached so far, -1 once it left the trie
+    reached = np.full(len(hadm), -1)
+    nodes = []
+    offset = 0
+
+    for depth in range(stages):
+        rows = step == depth
+        a, u = adm[rows], units[rows]
+        parent = reached[a] if depth else np.full(len(a), -1)
+        if depth:
+            alive = parent >= 0
+            a, u, parent = a[alive], u[alive], parent[alive]
+        if not len(a):
+            break
+
+        # Children of every node are its distinct next units
+        key = (parent + 1) * len(labels) + u
+        codes, keys = pd.factorize(key)
+        count = np.bincount(codes)
+
+        # Branches beyond the top ones are merged into a terminal Other node
+        pruned = (_rank(keys // len(labels), count) >= top)[codes]
+        u = np.where(pruned, other, u)
+        codes, keys = pd.factorize((parent + 1) * len(labels) + u)
+        count = np.bincount(codes)
+
+        # Number the nodes by parent, most frequent child first
+        order = np.lexsort((-count, keys // len(labels)))
+        position = np.empty(len(order), dtype=np.int64)
+        position[order] = np.arange(len(order))
+        codes, keys, count = position[codes], keys[order], count[order]
+
+        node = offset + codes
+        reached[a] = np.where(u == other, -1, node)
+
+        nodes.append(pd.DataFrame({
+            'NODE': offset + np.arange(len(keys)),
+            'PARENT': keys // len(labels) - 1,
+            'DEPTH': depth,
+            'UNIT': labels[keys % len(labels)],
+            'COUNT': count,
+        }))
+        offset += len(keys)
+
+    if not nodes:
+        return pd.DataFrame(columns=['NODE', 'PARENT', 'DEPTH', 'UNIT', 'COUNT'])
+
+    return pd.concat(nodes, ignore_index=True)
@@ -0,0 +1,142 @@
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+import psutil
+from dotenv import load_dotenv
+
+from modules.cache import TABLES
+
+load_dotenv('.env')
+PERF_LOG = os.getenv('PERF_LOG')
+
+SAMPLE_SECONDS = 0.005
+KINDS = ['load', 'transform', 'aggregate', 'render']
+
+_process = psutil.Process()
+_local = threading.local()
+
+
+def rss() -> int:
+    return _process.memory_info().rss
+
+
+class PeakRSS:
+
+    # Highest resident set size while the block runs, sampled from a
+    # background thread
+
+    def __enter__(self):
+        self.start = self.peak = rss()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._done.wait(SAMPLE_SECONDS):
+            self.peak = max(self.peak, rss())
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+        self.end = rss()
+        self.peak = max(self.peak, self.end)
+
+    @property
+    def delta_mb(self) -> float:
+        return (self.peak - self.start) / 2**20
+
+
+def begin(page: str = None, memory: bool = False) -> dict:
+
+    # A new record for the rerun running on this thread. The resident set
+    # is only sampled when asked for or logged, the sampling thread costs
+    # every stage
+    if page is None:
+        page = os.path.basename(getattr(sys.modules.get('__main__'), '__file__', '') or '')
+    _local.run = {
+        'page': page,
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'start': time.perf_counter(),
+        'stages': [],
+    }
+    _local.depth = 0
+    _local.memory = memory or bool(PERF_LOG)
+
+    return _local.run
+
+
+def current() -> dict | None:
+    return getattr(_local, 'run', None)
+
+
+@contextlib.contextmanager
+def stage(name: str, kind: str = 'transform'):
+
+    # Outside of a rerun (CLI, warm-up threads) the block just runs
+    run = current()
+    if run is None:
+        yield
+        return
+
+    record = {'stage': name, 'kind': kind, 'depth': _local.depth}
+    run['stages'].append(record)
+    # Cache counts of this thread only, other sessions hit the cache too
+    before = TABLES.thread_stats()
+    memory = PeakRSS() if _local.memory else contextlib.nullcontext()
+    _local.depth += 1
+    start = time.perf_counter()
+    try:
+        with memory:
+            yield record
+    finally:
+        _local.depth -= 1
+        after = TABLES.thread_stats()
+        record.update({
+            'seconds': round(time.perf_counter() - start, 4),
+            'peak_mb': round(memory.delta_mb, 2) if _local.memory else None,
+            'rss_mb': round((memory.end - memory.start) / 2**20, 2) if _local.memory else None,
+            'hits': after['hits'] - before['hits'],
+            'misses': after['misses'] - before['misses'],
+        })
+
+
+def timed(kind: str = 'transform', name: str = None):
+
+    # Decorator form of stage, named after the function by default
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name or func.__name__, kind):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def end() -> dict | None:
+
+    run = current()
+    if run is None:
+        return None
+
+    _local.run = None
+    run['seconds'] = round(time.perf_counter() - run.pop('start'), 4)
+    run['cache'] = TABLES.stats()
+
+    if PERF_LOG:
+        with open(PERF_LOG, 'a') as f:
+            f.write(json.dumps(run) + '\n')
+
+    return run
+
+
+def to_jsonl(runs) -> str:
+    return ''.join(json.dumps(run) + '\n' for run in runs)
@@ -0,0 +1,240 @@
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+from modules.data import atomic_path, read_manifest, write_manifest
+from modules.etl import tables_of
+from modules.perf import timed
+from modules.sources import version
+
+load_dotenv('.env')
+OUTPUT = os.getenv('OUTPUT') or 'output'
+PRERENDER = os.path.join(OUTPUT, 'prerender')
+MANIFEST = 'manifest.json'
+
+TOP_DIAGNOSES = 3
+
+logger = logging.getLogger(__name__)
+
+_manifest = (None, {})
+
+
+def _viz_1_grid() -> list[tuple]:
+
+    # Every year with no disease selected, the page default, and with each
+    # of its most frequent diseases alone
+    from pages import viz_1
+
+    grid = []
+    for yr in range(2100, 2211):
+        diseases = viz_1.get_disease_in_yr(yr)
+        for diag_name in [()] + [(name,) for name in diseases.index[:TOP_DIAGNOSES]]:
+            grid.append((yr, diag_name, 30, False, True))
+
+    return grid
+
+
+def _viz_1(yr, diag_name, max_node, drug_ind, proc_ind) -> bytes:
+    from pages import viz_1
+    html, _ = viz_1.get_graph(yr, tuple(diag_name), max_node, drug_ind, proc_ind)
+    return html.encode()
+
+
+def _viz_2_grid() -> list[tuple]:
+    from modules.backend import get_backend
+    axes = get_backend().admission_axes()
+    return [((yr, yr), tuple(axes['units'])) for yr in axes['years']]
+
+
+def _viz_2(yr, units) -> bytes:
+
+    import matplotlib.pyplot as plt
+    from pages import viz_2
+
+    fig = viz_2.get_heatmap(viz_2.get_pivot(tuple(yr), list(units)))
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight', dpi=200)
+    plt.close(fig)
+
+    return buffer.getvalue()
+
+
+def _viz_3_grid() -> list[tuple]:
+
+    from modules.backend import get_backend
+    from pages import viz_3
+
+    axes = get_backend().transfer_axes()
+    units = viz_3.get_nodes(axes) + [viz_3.ALL_UNITS]
+
+    return [(unit, (yr, yr)) for unit in units for yr in axes['years']]
+
+
+def _viz_3(unit, yr) -> bytes:
+    from pages import viz_3
+    return viz_3.get_chart(viz_3.aggregate_data(unit, tuple(yr))).to_json().encode()
+
+
+def _viz_4_grid() -> list[tuple]:
+    from pages import viz_4
+    return [(int(itemid), 100) for itemid in viz_4.get_lab_items()['ITEMID']]
+
+
+def _viz_4(itemid, sampling_size) -> bytes:
+
+    from pages import viz_4
+
+    item = viz_4.get_lab_items()
+    display = item.loc[item['ITEMID'] == itemid, 'DISPLAY'].iloc[0]
+    data = viz_4.get_result(viz_4.get_lab_readings(itemid, sampling_size), itemid)
+    unit = str(data['VALUEUOM'].iloc[0]) if len(data) else ''
+    fig = viz_4.get_box_chart(viz_4.get_box_stats(itemid, sampling_size, None),
+                              f'Reading of {display}', unit)
+
+    return fig.to_json().encode()
+
+
+def _viz_5_grid() -> list[tuple]:
+    from pages import viz_5
+    wards = list(viz_5.ICU_MAP)
+    return [(2100, 2200, tuple(wards))] + [(2100, 2200, (ward,)) for ward in wards]
+
+
+def _viz_5(yr_start, yr_end, wards) -> bytes:
+    from pages import viz_5
+    data = viz_5.filter_data(viz_5.load_data(), yr_start, yr_end, list(wards))
+    return viz_5.get_chart(data, yr_start, yr_end).to_json().encode()
+
+
+# Every pre-rendered view: its parameter grid, the render from the page
+# functions, the file type and the source tables the result depends on
+VIEWS = {
+    'viz_1': {'grid': _viz_1_grid, 'render': _viz_1, 'ext': 'html',
+              'tables': tables_of('cooccurrence')},
+    'viz_2': {'grid': _viz_2_grid, 'render': _viz_2, 'ext': 'png',
+              'tables': tables_of('admission_counts')},
+    'viz_3': {'grid': _viz_3_grid, 'render': _viz_3, 'ext': 'json',
+              'tables': tables_of('transfer_counts')},
+    'viz_4': {'grid': _viz_4_grid, 'render': _viz_4, 'ext': 'json',
+              'tables': ['D_LABITEMS', *tables_of('lab_catalog')]},
+    'viz_5': {'grid': _viz_5_grid, 'render': _viz_5, 'ext': 'json',
+              'tables': ['PATIENTS', 'ICUSTAYS']},
+}
+
+
+def manifest_path() -> str:
+    return os.path.join(PRERENDER, MANIFEST)
+
+
+def load_manifest() -> dict:
+    return read_manifest(manifest_path())
+
+
+def save_manifest(manifest: dict):
+    write_manifest(manifest_path(), manifest)
+
+
+def key(view: str, params: tuple) -> str:
+    return json.dumps([view, list(params)], default=str)
+
+
+def render_one(view: str, params: tuple) -> dict:
+
+    # Runs in a worker process, only the manifest entry goes back
+    start = time.perf_counter()
+    content = VIEWS[view]['render'](*params)
+
+    name = f'{view}-{hashlib.sha1(key(view, params).encode()).hexdigest()[:16]}.{VIEWS[view]["ext"]}'
+    with atomic_path(os.path.join(PRERENDER, name)) as tmp:
+        with open(tmp, 'wb') as f:
+            f.write(content)
+
+    return {'file': name, 'version': version(tuple(sorted(VIEWS[view]['tables']))),
+            'bytes': len(content), 'seconds': round(time.perf_counter() - start, 3)}
+
+
+def render(views: list[str] = None, workers: int = None, force: bool = False) -> dict:
+
+    os.makedirs(PRERENDER, exist_ok=True)
+    manifest = load_manifest()
+
+    # Entries rendered from the current version of their tables are kept
+    tasks = []
+    for view in views or list(VIEWS):
+        current = version(tuple(sorted(VIEWS[view]['tables'])))
+        for params in VIEWS[view]['grid']():
+            entry = manifest.get(key(view, params))
+            if force or entry is None or entry['version'] != current \
+                    or not os.path.exists(os.path.join(PRERENDER, entry['file'])):
+                tasks.append((view, params))
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_one, view, params): (view, params) for view, params in tasks}
+        for done, future in enumerate(as_completed(futures), 1):
+            view, params = futures[future]
+            manifest[key(view, params)] = future.result()
+            if done % 100 == 0 or done == len(tasks):
+                logger.info('%6d / %d rendered %8.1fs', done, len(tasks), time.perf_counter() - start)
+
+    save_manifest(manifest)
+
+    return manifest
+
+
+@timed('load')
+def prerendered(view: str, *params) -> bytes | None:
+
+    # Content of a pre-rendered view that is still current, None on a miss
+    global _manifest
+    try:
+        mtime = os.stat(manifest_path()).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _manifest[0] != mtime:
+        _manifest = (mtime, load_manifest())
+
+    entry = _manifest[1].get(key(view, params))
+    if entry is None or entry['version'] != version(tuple(sorted(VIEWS[view]['tables']))):
+        return None
+
+    try:
+        with open(os.path.join(PRERENDER, entry['file']), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Render the page views ahead of time')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('render', help='render the parameter grid of the views')
+    command.add_argument('views', nargs='*', help=f'views to render, all by default: {", ".join(VIEWS)}')
+    command.add_argument('--workers', type=int, default=None, help='worker processes')
+    command.add_argument('--force', action='store_true', help='render current entries again')
+
+    commands.add_parser('status', help='count the entries of every view')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.command == 'render':
+        unknown = set(args.views) - set(VIEWS)
+        if unknown:
+            parser.error(f'unknown views: {", ".join(sorted(unknown))}')
+        render(args.views, args.workers, args.force)
+    else:
+        manifest = load_manifest()
+        for view in VIEWS:
+            current = version(tuple(sorted(VIEWS[view]['tables'])))
+            entries = [entry for name, entry in manifest.items() if json.loads(name)[0] == view]
+            fresh = sum(entry['version'] == current for entry in entries)
+            print(f'{view:<8} {fresh:>6} current {len(entries) - fresh:>6} stale')
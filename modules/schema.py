@@ -0,0 +1,92 @@
+import pandas as pd
+import pyarrow as pa
+
+# Compact dtype of every MIMIC column the pages use. IDs fit in 32 bits;
+# nullable IDs are float32, which still represents them exactly. Repeated
+# strings are categoricals, stored dictionary encoded in parquet. Columns
+# that are not listed are kept as strings, like the titles of the ICD
+# dictionaries, which are unique per row and only grow as categoricals.
+SCHEMA = {
+    'ADMISSIONS': {
+        'SUBJECT_ID': 'int32', 'HADM_ID': 'int32',
+        'ADMITTIME': 'datetime64[ns]', 'DISCHTIME': 'datetime64[ns]',
+        'DEATHTIME': 'datetime64[ns]', 'EDREGTIME': 'datetime64[ns]',
+        'EDOUTTIME': 'datetime64[ns]',
+        'ADMISSION_TYPE': 'category', 'HOSPITAL_EXPIRE_FLAG': 'int8',
+        'HAS_CHARTEVENTS_DATA': 'int8',
+    },
+    'DIAGNOSES_ICD': {
+        'SUBJECT_ID': 'int32', 'HADM_ID': 'int32', 'SEQ_NUM': 'float32',
+    },
+    'D_ICD_DIAGNOSES': {},
+    'PROCEDURES_ICD': {
+        'SUBJECT_ID': 'int32', 'HADM_ID': 'int32', 'SEQ_NUM': 'int16',
+    },
+    'D_ICD_PROCEDURES': {},
+    'PRESCRIPTIONS': {
+        'SUBJECT_ID': 'int32', 'HADM_ID': 'int32', 'ICUSTAY_ID': 'float32',
+        'STARTDATE': 'datetime64[ns]', 'ENDDATE': 'datetime64[ns]',
+        'DRUG_TYPE': 'category', 'DRUG': 'category', 'ROUTE': 'category',
+    },
+    'ICUSTAYS': {
+        'SUBJECT_ID': 'int32', 'HADM_ID': 'int32', 'ICUSTAY_ID': 'int32',
+        'DBSOURCE': 'category', 'FIRST_CAREUNIT': 'category',
+        'LAST_CAREUNIT': 'category', 'FIRST_WARDID': 'int16',
+        'LAST_WARDID': 'int16', 'INTIME': 'datetime64[ns]',
+        'OUTTIME': 'datetime64[ns]', 'LOS': 'float32',
+    },
+    'TRANSFERS': {
+        'SUBJECT_ID': 'int32', 'HADM_ID': 'int32', 'ICUSTAY_ID': 'float32',
+        'DBSOURCE': 'category', 'EVENTTYPE': 'category',
+        'PREV_CAREUNIT': 'category', 'CURR_CAREUNIT': 'category',
+        'PREV_WARDID': 'float32', 'CURR_WARDID': 'float32',
+        'INTIME': 'datetime64[ns]', 'OUTTIME': 'datetime64[ns]', 'LOS': 'float32',
+    },
+    'PATIENTS': {
+        'SUBJECT_ID': 'int32', 'GENDER': 'category',
+        'DOB': 'datetime64[ns]', 'DOD': 'datetime64[ns]',
+        'DOD_HOSP': 'datetime64[ns]', 'DOD_SSN': 'datetime64[ns]',
+        'EXPIRE_FLAG': 'int8',
+    },
+    'LABEVENTS': {
+        'SUBJECT_ID': 'int32', 'HADM_ID': 'float32', 'ITEMID': 'int32',
+        'CHARTTIME': 'datetime64[ns]', 'VALUENUM': 'float32',
+        'VALUEUOM': 'category', 'FLAG': 'category',
+    },
+    'D_LABITEMS': {
+        'ITEMID': 'int32', 'FLUID': 'category', 'CATEGORY': 'category',
+    },
+}
+
+ARROW_TYPES = {
+    'int8': pa.int8(), 'int16': pa.int16(), 'int32': pa.int32(),
+    'float32': pa.float32(), 'datetime64[ns]': pa.timestamp('ns'),
+    'category': pa.dictionary(pa.int32(), pa.string()),
+}
+
+
+def arrow_type(name: str, column: str) -> pa.DataType:
+    return ARROW_TYPES.get(SCHEMA[name].get(column), pa.string())
+
+
+def apply_schema(data: pd.DataFrame, name: str) -> pd.DataFrame:
+
+    dtypes = {}
+    for column, dtype in SCHEMA[name].items():
+        if column not in data or data[column].dtype == dtype:
+            continue
+        if dtype.startswith('int') and data[column].isna().any():
+            dtype = 'float32'
+        dtypes[column] = dtype
+    # Columns already in their dtype stay views of the arrow buffers
+    if dtypes:
+        data = data.astype(dtypes, copy=False)
+
+    # Lexical category order, so sorting a categorical sorts by value.
+    # Shared tables are exported with sorted dictionaries already
+    for column in data.select_dtypes('category'):
+        categories = data[column].cat.categories
+        if not categories.is_monotonic_increasing:
+            data[column] = data[column].cat.reorder_categories(categories.sort_values())
+
+    return data
@@ -0,0 +1,77 @@
+import hashlib
+import os
+
+from modules.data import CACHE, read_manifest, source_path, write_manifest
+
+MANIFEST = 'manifest.json'
+
+# Content hash of every source table as last recorded in the manifest, and
+# the version tokens derived from them
+_hashes = {}
+_versions = {}
+_mtime = None
+
+
+def manifest_path() -> str:
+    return os.path.join(CACHE, MANIFEST)
+
+
+def load_manifest() -> dict:
+    return read_manifest(manifest_path())
+
+
+def save_manifest(manifest: dict):
+    write_manifest(manifest_path(), manifest)
+
+
+def fingerprint(name: str, previous: dict = None) -> dict:
+
+    # Size and mtime are cheap to read, the file is only hashed again when
+    # one of them moved since the previous fingerprint
+    stat = os.stat(source_path(name))
+    if previous and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime_ns:
+        return previous
+
+    with open(source_path(name), 'rb') as f:
+        digest = hashlib.file_digest(f, 'sha256').hexdigest()
+
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': digest}
+
+
+def reload() -> list[str]:
+
+    # Picks up fingerprints written by this or another process, returning
+    # the tables whose version changed since the last reload, also those
+    # recorded or dropped since then
+    global _hashes, _versions, _mtime
+    try:
+        mtime = os.stat(manifest_path()).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    if mtime == _mtime:
+        return []
+    _mtime = mtime
+
+    hashes = {name: source['sha256'] for name, source in load_manifest().get('sources', {}).items()}
+    changed = sorted(name for name in hashes.keys() | _hashes.keys()
+                     if _hashes.get(name) != hashes.get(name))
+    _hashes, _versions = hashes, {}
+
+    return changed
+
+
+def version(tables: tuple[str] = None) -> str:
+
+    # Token of the recorded content of the tables, all of them by default,
+    # that changes whenever one of them is rebuilt from a new file
+    versions = _versions
+    if tables not in versions:
+        hashes = _hashes
+        names = sorted(hashes) if tables is None else sorted(tables)
+        token = ''.join(f'{name}={hashes.get(name)};' for name in names)
+        versions[tables] = hashlib.sha256(token.encode()).hexdigest()[:16]
+
+    return versions[tables]
+
+
+reload()
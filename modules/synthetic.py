@@ -0,0 +1,298 @@
+import argparse
+import contextlib
+import gzip
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+# Patients per scale: the public demo, the full MIMIC-III release and ten
+# times the full release
+SCALES = {'demo': 100, 'full': 46_520, '10x': 465_200}
+
+# Patients generated at a time, which bounds memory at any scale
+CHUNK_PATIENTS = 5_000
+SEED = 2100
+
+# Mean rows per admission in MIMIC-III
+RATES = {
+    'ADMISSIONS': 0.27,
+    'DIAGNOSES_ICD': 11,
+    'PROCEDURES_ICD': 4,
+    'PRESCRIPTIONS': 70,
+    'TRANSFERS': 1.5,
+    'LABEVENTS': 470,
+}
+
+UNITS = ['CCU', 'CSRU', 'MICU', 'SICU', 'TSICU']
+UNIT_P = [.15, .2, .35, .15, .15]
+WARD_P = .35
+ADMISSION_TYPES = ['EMERGENCY', 'ELECTIVE', 'URGENT']
+DRUG_TYPES = ['MAIN', 'BASE', 'ADDITIVE']
+ROUTES = ['IV', 'PO', 'IV DRIP', 'SC', 'NG']
+FLUIDS = ['Blood', 'Urine', 'Other Body Fluid']
+CATEGORIES = ['Chemistry', 'Hematology', 'Blood Gas']
+
+N_DIAGNOSES = 14_567
+N_PROCEDURES = 3_882
+N_DRUGS = 4_525
+N_LABS = 753
+
+DAY = 86_400
+START = int(np.datetime64('2100-01-01', 's').astype(np.int64))
+SPAN = 110 * 365 * DAY
+
+
+def _zipf(n: int) -> np.ndarray:
+
+    # Code frequencies fall off like MIMIC's, a few codes cover most rows
+    p = 1 / np.arange(1, n + 1) ** 1.1
+    return p / p.sum()
+
+
+def _ts(seconds: np.ndarray, mask: np.ndarray = None) -> pa.Array:
+    return pa.array(np.asarray(seconds, dtype=np.int64), pa.timestamp('s'), mask=mask)
+
+
+def _str(values: np.ndarray, mask: np.ndarray = None) -> pa.Array:
+    return pa.array(np.asarray(values, dtype=object), pa.string(), mask=mask)
+
+
+def _repeat(counts: np.ndarray) -> tuple:
+
+    # Parent position and position within the parent of every child row
+    parent = np.repeat(np.arange(len(counts)), counts)
+    within = np.arange(len(parent)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    return parent, within
+
+
+def dictionaries() -> dict:
+
+    rng = np.random.default_rng(SEED)
+    diagnoses = np.array([f'{i:05d}' for i in range(N_DIAGNOSES)])
+    procedures = np.array([f'{i:04d}' for i in range(N_PROCEDURES)])
+    items = 50_800 + np.arange(N_LABS)
+
+    return {
+        'D_ICD_DIAGNOSES': pa.table({
+            'ICD9_CODE': _str(diagnoses),
+            'SHORT_TITLE': _str([f'Diag {code}' for code in diagnoses]),
+            'LONG_TITLE': _str([f'Diagnosis {code}' for code in diagnoses]),
+        }),
+        'D_ICD_PROCEDURES': pa.table({
+            'ICD9_CODE': _str(procedures),
+            'SHORT_TITLE': _str([f'Proc {code}' for code in procedures]),
+            'LONG_TITLE': _str([f'Procedure {code}' for code in procedures]),
+        }),
+        'D_LABITEMS': pa.table({
+            'ITEMID': pa.array(items),
+            'LABEL': _str([f'Lab {item}' for item in items]),
+            'FLUID': _str(rng.choice(FLUIDS, N_LABS)),
+            'CATEGORY': _str(rng.choice(CATEGORIES, N_LABS)),
+            'LOINC_CODE': pa.nulls(N_LABS, pa.string()),
+        }),
+    }
+
+
+def chunk(rng: np.random.Generator, first: dict, patients: int) -> dict:
+
+    tables = {}
+
+    # Patients: adults, a share of neonates, and the >89 year olds MIMIC
+    # shifts to about 300 years
+    subject = first['SUBJECT_ID'] + np.arange(patients)
+    kind = rng.choice(3, patients, p=[.9, .08, .02])
+    age = np.where(kind == 0, rng.normal(64, 17, patients).clip(18, 89),
+                   np.where(kind == 1, 0, 300))
+    first_admit = START + rng.integers(0, SPAN, patients)
+    dob = first_admit - (age * 365.25 * DAY).astype(np.int64) - rng.integers(0, 365 * DAY, patients)
+
+    # Admissions, later ones of a patient spaced weeks to years apart
+    counts = 1 + rng.poisson(RATES['ADMISSIONS'], patients)
+    patient, within = _repeat(counts)
+    admissions = len(patient)
+    hadm = first['HADM_ID'] + np.arange(admissions)
+    admittime = first_admit[patient] + within * rng.integers(30, 700, admissions) * DAY
+    dischtime = admittime + (rng.lognormal(1.8, .8, admissions) * DAY).astype(np.int64)
+
+    last = np.r_[within[1:] == 0, True]
+    died = last & (rng.random(admissions) < .12)
+    expire = np.zeros(patients, dtype=bool)
+    expire[patient[died]] = True
+    dod = np.zeros(patients, dtype=np.int64)
+    dod[patient[died]] = dischtime[died]
+
+    tables['PATIENTS'] = pa.table({
+        'SUBJECT_ID': pa.array(subject),
+        'GENDER': _str(rng.choice(['F', 'M'], patients, p=[.44, .56])),
+        'DOB': _ts(dob),
+        'DOD': _ts(dod, ~expire),
+        'DOD_HOSP': _ts(dod, ~expire),
+        'DOD_SSN': _ts(dod, ~expire),
+        'EXPIRE_FLAG': pa.array(expire.astype(np.int8)),
+    })
+
+    tables['ADMISSIONS'] = pa.table({
+        'SUBJECT_ID': pa.array(subject[patient]),
+        'HADM_ID': pa.array(hadm),
+        'ADMITTIME': _ts(admittime),
+        'DISCHTIME': _ts(dischtime),
+        'DEATHTIME': _ts(dischtime, ~died),
+        'ADMISSION_TYPE': _str(np.where(kind[patient] == 1, 'NEWBORN',
+                                        rng.choice(ADMISSION_TYPES, admissions))),
+        'HOSPITAL_EXPIRE_FLAG': pa.array(died.astype(np.int8)),
+    })
+
+    # One ICU stay per admission, neonates in the NICU
+    unit = np.where(kind[patient] == 1, 'NICU', rng.choice(UNITS, admissions, p=UNIT_P))
+    intime = admittime + rng.integers(0, DAY, admissions)
+    los = rng.lognormal(.8, 1., admissions)
+    outtime = intime + (los * DAY).astype(np.int64)
+
+    # Transfers: admit, hops to another unit or a ward, discharge
+    hops = np.minimum(rng.poisson(RATES['TRANSFERS'], admissions), 5)
+    stay, step = _repeat(hops + 2)
+    starts = np.cumsum(hops + 2) - hops - 2
+    events = len(stay)
+    discharge = step == hops[stay] + 1
+    icu = (step == 0) | ~((rng.random(events) < WARD_P) | discharge)
+
+    curr = np.where(kind[patient][stay] == 1, 'NICU', rng.choice(UNITS, events, p=UNIT_P))
+    curr = np.where(step == 0, unit[stay], curr).astype(object)
+    curr[~icu] = None
+    prev = np.r_[None, curr[:-1]].astype(object)
+    prev[step == 0] = None
+    last_unit = curr[np.maximum.reduceat(np.where(icu, np.arange(events), -1), starts)]
+
+    elapsed = np.cumsum(np.where(step == 0, 0, rng.integers(3600, 3 * DAY, events)))
+    event_in = intime[stay] + elapsed - elapsed[starts][stay]
+    event_out = np.r_[event_in[1:], 0]
+    ward_id = rng.integers(1, 60, events).astype(np.float64)
+
+    tables['ICUSTAYS'] = pa.table({
+        'SUBJECT_ID': pa.array(subject[patient]),
+        'HADM_ID': pa.array(hadm),
+        'ICUSTAY_ID': pa.array(first['ICUSTAY_ID'] + np.arange(admissions)),
+        'DBSOURCE': _str(rng.choice(['carevue', 'metavision'], admissions)),
+        'FIRST_CAREUNIT': _str(unit),
+        'LAST_CAREUNIT': _str(last_unit),
+        'FIRST_WARDID': pa.array(rng.integers(1, 60, admissions)),
+        'LAST_WARDID': pa.array(rng.integers(1, 60, admissions)),
+        'INTIME': _ts(intime),
+        'OUTTIME': _ts(outtime),
+        'LOS': pa.array(los.round(4)),
+    })
+
+    tables['TRANSFERS'] = pa.table({
+        'SUBJECT_ID': pa.array(subject[patient][stay]),
+        'HADM_ID': pa.array(hadm[stay]),
+        'ICUSTAY_ID': pa.array(first['ICUSTAY_ID'] + stay, mask=~icu),
+        'DBSOURCE': _str(rng.choice(['carevue', 'metavision'], events)),
+        'EVENTTYPE': _str(np.where(step == 0, 'admit', np.where(discharge, 'discharge', 'transfer'))),
+        'PREV_CAREUNIT': _str(prev),
+        'CURR_CAREUNIT': _str(curr),
+        'PREV_WARDID': pa.array(np.r_[np.nan, ward_id[:-1]], mask=step == 0),
+        'CURR_WARDID': pa.array(ward_id, mask=discharge),
+        'INTIME': _ts(event_in),
+        'OUTTIME': _ts(event_out, discharge),
+        'LOS': pa.array(((event_out - event_in) / DAY).round(2), mask=discharge),
+    })
+
+    # Coded events per admission with Zipf-like code frequencies
+    for name, rate, n_codes in [('DIAGNOSES_ICD', RATES['DIAGNOSES_ICD'], N_DIAGNOSES),
+                                ('PROCEDURES_ICD', RATES['PROCEDURES_ICD'], N_PROCEDURES)]:
+        adm, seq = _repeat(1 + rng.poisson(rate - 1, admissions))
+        code = rng.choice(n_codes, len(adm), p=_zipf(n_codes))
+        width = 5 if name == 'DIAGNOSES_ICD' else 4
+        tables[name] = pa.table({
+            'SUBJECT_ID': pa.array(subject[patient][adm]),
+            'HADM_ID': pa.array(hadm[adm]),
+            'SEQ_NUM': pa.array(seq + 1),
+            'ICD9_CODE': pc.utf8_lpad(pc.cast(pa.array(code), pa.string()), width, '0'),
+        })
+
+    adm, _ = _repeat(rng.poisson(RATES['PRESCRIPTIONS'], admissions))
+    start = admittime[adm] + rng.integers(0, 3, len(adm)) * DAY
+    tables['PRESCRIPTIONS'] = pa.table({
+        'SUBJECT_ID': pa.array(subject[patient][adm]),
+        'HADM_ID': pa.array(hadm[adm]),
+        'ICUSTAY_ID': pa.array(first['ICUSTAY_ID'] + adm),
+        'STARTDATE': _ts(start),
+        'ENDDATE': _ts(start + rng.integers(1, 10, len(adm)) * DAY),
+        'DRUG_TYPE': _str(rng.choice(DRUG_TYPES, len(adm), p=[.8, .15, .05])),
+        'DRUG': pc.binary_join_element_wise(
+            'Drug ', pc.cast(pa.array(rng.choice(N_DRUGS, len(adm), p=_zipf(N_DRUGS))), pa.string()), ''),
+        'ROUTE': _str(rng.choice(ROUTES, len(adm))),
+    })
+
+    # Lab readings around an item specific mean; some are outpatient (no
+    # admission) or non numeric
+    adm, _ = _repeat(rng.poisson(RATES['LABEVENTS'], admissions))
+    item = rng.choice(N_LABS, len(adm), p=_zipf(N_LABS))
+    z = rng.standard_normal(len(adm))
+    value = (10 + item % 140 + z * (1 + item % 7)).round(2)
+    numeric = rng.random(len(adm)) < .95
+    tables['LABEVENTS'] = pa.table({
+        'SUBJECT_ID': pa.array(subject[patient][adm]),
+        'HADM_ID': pa.array(hadm[adm], mask=rng.random(len(adm)) < .1),
+        'ITEMID': pa.array(50_800 + item),
+        'CHARTTIME': _ts(intime[adm] + rng.integers(0, 5 * DAY, len(adm))),
+        'VALUE': pc.cast(pa.array(value), pa.string()),
+        'VALUENUM': pa.array(value, mask=~numeric),
+        'VALUEUOM': _str(np.array(['mg/dL', 'mEq/L', 'K/uL', '%'])[item % 4]),
+        'FLAG': _str(np.where(np.abs(z) > 2, 'abnormal', None)),
+    })
+
+    first['SUBJECT_ID'] += patients
+    first['HADM_ID'] += admissions
+    first['ICUSTAY_ID'] += admissions
+
+    return tables
+
+
+def generate(out: str, patients: int, seed: int = SEED) -> dict:
+
+    # Gzip CSVs laid out like the MIMIC-III release, written a chunk of
+    # patients at a time
+    os.makedirs(out, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    first = {'SUBJECT_ID': 1, 'HADM_ID': 100_000, 'ICUSTAY_ID': 200_000}
+    rows = {}
+
+    with contextlib.ExitStack() as stack:
+        writers = {}
+
+        def write(name: str, table: pa.Table):
+            offset = rows.get(name, 0)
+            table = table.add_column(0, 'ROW_ID', pa.array(np.arange(offset + 1, offset + table.num_rows + 1)))
+            if name not in writers:
+                stream = stack.enter_context(gzip.open(os.path.join(out, f'{name}.csv.gz'), 'wb',
+                                                       compresslevel=1))
+                writers[name] = stack.enter_context(pv.CSVWriter(stream, table.schema))
+            writers[name].write_table(table)
+            rows[name] = offset + table.num_rows
+
+        for name, table in dictionaries().items():
+            write(name, table)
+        for start in range(0, patients, CHUNK_PATIENTS):
+            for name, table in chunk(rng, first, min(CHUNK_PATIENTS, patients - start)).items():
+                write(name, table)
+
+    return rows
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Write synthetic MIMIC-III shaped tables')
+    parser.add_argument('out', help='directory for the .csv.gz tables')
+    parser.add_argument('--scale', choices=list(SCALES), default='demo')
+    parser.add_argument('--patients', type=int, help='patients, overrides --scale')
+    parser.add_argument('--seed', type=int, default=SEED)
+    args = parser.parse_args()
+
+    rows = generate(args.out, args.patients or SCALES[args.scale], args.seed)
+    for name, count in rows.items():
+        print(f'{name:<20} {count:>12,}')
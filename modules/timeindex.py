@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+from modules.cache import sizeof
+from modules.data import load_table
+
+
+class TimeIndex:
+
+    # Rows sorted by a timestamp column, optionally within groups of a key
+    # column, with the first row of every year precomputed. A year or a
+    # range of years is then a slice found with searchsorted, and the rows
+    # come back as a view of the sorted frame instead of a masked copy
+
+    def __init__(self, data: pd.DataFrame, column: str, by: str = None):
+
+        self.column, self.by = column, by
+        data = data.dropna(subset=[column, by] if by else [column])
+
+        # Groups in lexical order of their string values, whatever the
+        # category order of the column
+        times = data[column].to_numpy()
+        groups = data[by].astype(str).to_numpy() if by else np.zeros(len(data), dtype=str)
+        order = np.lexsort((times, groups))
+        self.data = data.iloc[order].reset_index(drop=True)
+        times, groups = times[order], groups[order]
+
+        years = self.data[column].dt.year.to_numpy()
+        self.first = int(years.min()) if len(years) else 0
+        self.last = int(years.max()) if len(years) else -1
+        starts = np.array([f'{yr}-01-01' for yr in range(self.first, self.last + 2)],
+                          dtype='datetime64[ns]')
+
+        # Row where every year starts, within every group
+        self.keys = [str(key) for key in np.unique(groups)] if by else [None]
+        self.bounds = {}
+        for key in self.keys:
+            lo, hi = (np.searchsorted(groups, key, side='left'),
+                      np.searchsorted(groups, key, side='right')) if by else (0, len(groups))
+            self.bounds[key] = lo + np.searchsorted(times[lo:hi], starts, side='left')
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __sizeof__(self) -> int:
+        return sizeof(self.data) + sum(bounds.nbytes for bounds in self.bounds.values())
+
+    def span(self, yr: int | tuple[int, int], key=None) -> tuple[int, int]:
+
+        # Rows [lo, hi) of an inclusive year range, clipped to the data
+        yr_start, yr_end = (yr, yr) if not isinstance(yr, (tuple, list)) else yr
+        bounds = self.bounds.get(key)
+        if bounds is None or yr_start > yr_end:
+            return 0, 0
+        first = min(max(int(yr_start) - self.first, 0), len(bounds) - 1)
+        last = min(max(int(yr_end) + 1 - self.first, 0), len(bounds) - 1)
+
+        return int(bounds[first]), int(bounds[last])
+
+    def slice(self, yr: int | tuple[int, int], keys: list[str] = None) -> pd.DataFrame:
+
+        if self.by is None:
+            lo, hi = self.span(yr)
+            return self.data.iloc[lo:hi]
+
+        # One contiguous slice per key, only these are copied when joined
+        parts = [self.data.iloc[slice(*self.span(yr, key))] for key in keys or self.keys]
+        if not parts:
+            return self.data.iloc[0:0]
+
+        return pd.concat(parts) if len(parts) > 1 else parts[0]
+
+    def years(self) -> list[int]:
+        return list(range(self.first, self.last + 1))
+
+
+def load_time_index(name: str,
+                    column: str,
+                    columns: list[str],
+                    by: str = None,
+                    filter: ds.Expression = None) -> TimeIndex:
+
+    return TimeIndex(load_table(name, columns=columns, filter=filter), column, by)
@@ -0,0 +1,79 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from modules.backend import get_backend
+
+load_dotenv('.env')
+WARMUP = os.getenv('WARMUP', '1') != '0'
+WORKERS = int(os.getenv('WARMUP_WORKERS', 4))
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_futures = None
+
+
+# Each task loads what a page needs for its default view into the shared
+# table cache, through the same cached functions the page calls
+
+def _viz_1():
+    from pages import viz_1
+    viz_1.get_disease_in_yr(2100)
+
+
+def _viz_2():
+    from pages import viz_2
+    axes = get_backend().admission_axes()
+    viz_2.get_pivot((min(axes['years']), min(axes['years'])), axes['units'])
+
+
+def _viz_3():
+    from pages import viz_3
+    axes = get_backend().transfer_axes()
+    viz_3.aggregate_data(axes['units'][0], (min(axes['years']), min(axes['years'])))
+
+
+def _viz_4():
+    from pages import viz_4
+    items = viz_4.get_lab_items()
+    viz_4.get_box_stats(items['ITEMID'].iloc[0], 100, None)
+
+
+def _viz_5():
+    from pages import viz_5
+    viz_5.load_data()
+
+
+def _cohort():
+    from modules.cohort import get_cohort_index
+    get_cohort_index()
+
+
+TASKS = [_viz_1, _viz_2, _viz_3, _viz_4, _viz_5, _cohort]
+
+
+def _run(task):
+    try:
+        task()
+    except Exception:
+        # The page loads the same data itself and reports the error there
+        logger.warning('warm-up %s failed', task.__name__, exc_info=True)
+
+
+def warm_up() -> list:
+
+    # Started once per server process, the first visitor does not wait
+    global _futures
+    with _lock:
+        if _futures is None:
+            _futures = []
+            if WARMUP:
+                executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='warmup')
+                _futures = [executor.submit(_run, task) for task in TASKS]
+                executor.shutdown(wait=False)
+
+    return _futures
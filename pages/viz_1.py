@@ -2,157 +2,56 @@ import streamlit as st
 import streamlit.components.v1 as components
 import pandas as pd
 from dotenv import load_dotenv
-from modules.nav import sidebar
-import os
+from modules.backend import get_backend
+from modules.cache import cached
+from modules.etl import tables_of
+from modules.nav import diagnostics, sidebar
+from modules.perf import stage, timed
+from modules.prerender import prerendered
 import warnings
 
-from pyvis.network import Network
-
 load_dotenv('.env')
-DIR = os.getenv('DIR')
 warnings.filterwarnings("ignore")
 
-@st.cache_data
-def get_admissions() -> pd.DataFrame:
-
-    admission = pd.read_csv(os.path.join(DIR, 'ADMISSIONS.csv.gz'), compression='gzip')
-    admission['ADMITTIME'] = pd.to_datetime(admission['ADMITTIME'])
-    admission.drop(['ROW_ID'], axis=1, inplace=True)
-
-    #admission = admission[admission['ADMITTIME'].dt.year == yr]
-
-    return admission
-
-@st.cache_data
-def get_diagnosis() -> pd.DataFrame:
-    
-    diagnosis = pd.read_csv(os.path.join(DIR, 'DIAGNOSES_ICD.csv.gz'), compression='gzip')
-    diag_label = pd.read_csv(os.path.join(DIR, 'D_ICD_DIAGNOSES.csv.gz'), compression='gzip')
-
-    diagnosis.drop(['ROW_ID'], axis=1, inplace=True)
-    diag_label.drop(['ROW_ID'], axis=1, inplace=True)
-
-    diagnosis = pd.merge(diagnosis, diag_label, on='ICD9_CODE')
-
-    return diagnosis
-
-@st.cache_data
-def get_prescriptions() -> pd.DataFrame:
-    
-    prescriptions = pd.read_csv(os.path.join(DIR, 'PRESCRIPTIONS.csv.gz'), compression='gzip')
-    prescriptions.drop(['ROW_ID'], axis=1, inplace=True)
+@timed('load')
+def get_disease_in_yr(yr: int) -> pd.Series:
 
-    return prescriptions
+    return get_backend().diagnoses(yr)
 
-def get_disease_in_yr(admissions: pd.DataFrame, 
-                      diagnosis: pd.DataFrame,
-                      yr: int):
 
-    #disease_desc = pd.read_csv(os.path.join(DIR, 'D_ICD_DIAGNOSES.csv.gz'), compression='gzip')
-    data = admissions[admissions['ADMITTIME'].dt.year == yr]
-    data = pd.merge(data,diagnosis, on='HADM_ID')
-    #data = pd.merge(data, disease_desc, on='ICD9_CODE')
-    data.head(2)
-    data = data[['ICD9_CODE', 'LONG_TITLE']]
-
-    return data['LONG_TITLE'].unique()
-
-
-def get_procs(admissions: pd.DataFrame, 
-            diagnosis: pd.DataFrame,
-            diagnosis_desc:str, 
+@timed('aggregate')
+def get_procs(diagnosis_desc:str, 
             yr:int,
             top: int = 30):
 
-    procs = pd.read_csv(os.path.join(DIR, 'PROCEDURES_ICD.csv.gz'), compression='gzip')
-    procs_desc = pd.read_csv(os.path.join(DIR, 'D_ICD_PROCEDURES.csv.gz'), compression='gzip')
-    
-    procs.drop(['ROW_ID'], axis=1, inplace=True)
-    procs_desc.drop(['ROW_ID'], axis=1, inplace=True)
-
-    diagnosis = diagnosis[diagnosis['LONG_TITLE'].isin(diagnosis_desc)]
-    admissions = admissions[admissions['ADMITTIME'].dt.year == yr]
-    diagnosis = pd.merge(diagnosis, admissions, on ='HADM_ID')
-    
-    procs = pd.merge(procs, procs_desc, on='ICD9_CODE')
-    procs = pd.merge(procs, diagnosis, on='HADM_ID')
-
-    procs = procs.groupby(['LONG_TITLE_y','LONG_TITLE_x'])['HADM_ID'].count().reset_index()
-    procs.columns = ['source','target', 'weight']
-    procs['category'] = 'proc'
-    procs = procs.sort_values(by='weight', ascending=False)
-
-    return procs.head(top)
+    return get_backend().edges('proc', diagnosis_desc, yr, top)
 
 
-def get_drugs(admissions: pd.DataFrame, 
-            diagnosis: pd.DataFrame, 
-            prescriptions: pd.DataFrame,
-            diagnosis_desc:str, 
+@timed('aggregate')
+def get_drugs(diagnosis_desc:str, 
             yr:int,
             top: int = 30):
 
-    diagnosis = diagnosis[diagnosis['LONG_TITLE'].isin(diagnosis_desc)]
-    
-    admissions = admissions[admissions['ADMITTIME'].dt.year == yr]
-    diagnosis = pd.merge(diagnosis, admissions, on ='HADM_ID')
-
-    drugs = pd.merge(prescriptions, diagnosis, on='HADM_ID')
+    return get_backend().edges('drug', diagnosis_desc, yr, top)
 
-    drugs = drugs.groupby(['LONG_TITLE','DRUG'])['HADM_ID'].count().reset_index()
-    drugs.columns = ['source','target', 'weight']
-    drugs['category'] = 'drug'
-    drugs = drugs.sort_values(by='weight', ascending=False)
-
-    return drugs.head(top)
-
-def main():
-
-    sidebar()
-
-    st.title('MIMIC III Visualization #1')
-    st.subheader(f'Network Graph of Diseases, Drugs, and Procedures (Top 30)')
-    
-    data_load_state = st.text('Loading data...')
-    
-    adms = get_admissions()
-    diags = get_diagnosis()
-    prescs = get_prescriptions()
-
-    data_load_state.text('')
-    
-    with st.expander("Query Parameter", expanded = True ):
-        col_input_1, col_input_2 = st.columns(2)
-        with col_input_1:
-            yr = st.slider("Year", min_value=2100, max_value=2210)
-
-        with col_input_2:
-            max_node = st.number_input("Maximum Node", 
-                                        value=30,
-                                        max_value=30, 
-                                        min_value=1)
-        
-        diag_name = st.multiselect('Diseases', 
-                                   get_disease_in_yr(adms, diags, yr),
-                                    max_selections=3)
-        
-        col_cat_1, col_cat_2 = st.columns(2)
-        with col_cat_1:
-            drug_ind = st.checkbox('Drugs')
-                
-        with col_cat_2:
-            proc_ind = st.checkbox('Procedures', value=True)
+@timed('render')
+@cached(tables=tables_of('cooccurrence'))
+def get_graph(yr: int, 
+              diag_name: tuple[str], 
+              max_node: int, 
+              drug_ind: bool, 
+              proc_ind: bool) -> tuple[str, pd.DataFrame]:
 
-    nodes = pd.DataFrame()     
+    nodes = pd.DataFrame(columns=['source', 'target', 'weight', 'category'])
 
     if drug_ind:
         nodes = pd.concat([
-            nodes, get_drugs(adms, diags, prescs, diag_name, yr, max_node)
+            nodes, get_drugs(list(diag_name), yr, max_node)
         ])
 
     if proc_ind:
         nodes = pd.concat([
-            nodes, get_procs(adms, diags, diag_name, yr, max_node)
+            nodes, get_procs(list(diag_name), yr, max_node)
         ])
 
     s = nodes['source']
@@ -162,6 +61,9 @@ def main():
 
     edges = zip(s,t,w,c)
  
+    # pyvis is only imported once a graph is actually rendered
+    from pyvis.network import Network
+
     # Initiate PyVis network object
     diag_net = Network(
                        height='800px',
@@ -191,13 +93,51 @@ def main():
         damping=0.95
     )
     
-    # Save and read graph as HTML file (on Streamlit Sharing)
-    output = os.getenv('OUTPUT')
-    diag_net.save_graph(os.path.join(output, 'pyvis_graph.html')[0:])
-    HtmlFile = open(os.path.join(output, 'pyvis_graph.html'), 'r', encoding='utf-8')
+    # Render the graph in memory, each parameter set is cached separately
+    return diag_net.generate_html(), nodes
+
+def main():
+
+    sidebar()
+
+    st.title('MIMIC III Visualization #1')
+    st.subheader(f'Network Graph of Diseases, Drugs, and Procedures (Top 30)')
+    
+    with st.expander("Query Parameter", expanded = True ):
+        col_input_1, col_input_2 = st.columns(2)
+        with col_input_1:
+            yr = st.slider("Year", min_value=2100, max_value=2210)
+
+        with col_input_2:
+            max_node = st.number_input("Maximum Node", 
+                                        value=30,
+                                        max_value=30, 
+                                        min_value=1)
+        
+        diseases = get_disease_in_yr(yr)
+        diag_name = st.multiselect('Diseases', 
+                                   diseases.index,
+                                   format_func=lambda name: f'{name} ({diseases[name]})',
+                                    max_selections=3)
+        
+        col_cat_1, col_cat_2 = st.columns(2)
+        with col_cat_1:
+            drug_ind = st.checkbox('Drugs')
+                
+        with col_cat_2:
+            proc_ind = st.checkbox('Procedures', value=True)
+
+    # Served from the pre-rendered graph when there is one
+    params = (yr, tuple(sorted(diag_name)), max_node, drug_ind, proc_ind)
+    html = prerendered('viz_1', *params)
+    if html is not None:
+        html, nodes = html.decode(), None
+    else:
+        html, nodes = get_graph(*params)
 
     # # Load HTML file in HTML component for display on Streamlit page
-    components.html(HtmlFile.read(), height=800)
+    with stage('html', 'render'):
+        components.html(html, height=800)
 
     col_lg_1, col_lg_2, col_lg_3 = st.columns(3)
 
@@ -218,7 +158,9 @@ def main():
 
     if st.checkbox('Show raw data'):
         st.subheader('Raw data')
-        st.write(nodes)
+        st.write(nodes if nodes is not None else get_graph(*params)[1])
+
+    diagnostics()
 
 
 if __name__ == '__main__':
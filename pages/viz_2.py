@@ -1,64 +1,61 @@
 import streamlit as st
 from dotenv import load_dotenv
 import pandas as pd
-import plotly.express as px
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
-import seaborn as sns
-import os
 
-from modules.nav import sidebar
+from modules.backend import get_backend
+from modules.cache import cached
+from modules.data import load_table
+from modules.nav import diagnostics, sidebar
+from modules.perf import stage, timed
+from modules.prerender import prerendered
 
 load_dotenv('.env')
-dir = os.getenv('DIR')
-DATE_COLUMNS = ['intime', 'outtime']
-DAYS = ['Monday','Tuesday','Wednesday','Thursday','Friday','Saturday', 'Sunday']
 
-@st.cache_data
-def get_dataset(name) -> pd.date_range:
+@timed('load')
+@cached
+def get_dataset(name, columns: list[str] = None) -> pd.date_range:
 
     # Load ICUSTAYS data
-    data = pd.read_csv(os.path.join(dir, f'{name}.csv.gz'), compression='gzip')
+    data = load_table(name, columns=columns)
     lowercase = lambda x: str(x).lower()
     data.rename(lowercase, axis='columns', inplace=True)
 
-    for COL in DATE_COLUMNS:
-        data[COL] = pd.to_datetime(data[COL])
-
     return data
 
-def get_pivot(data: pd.DataFrame , input_yr: int, 
-              selected_units: list[str]) -> pd.date_range:
+@timed('aggregate')
+def get_pivot(input_yr: int | tuple[int, int], 
+              selected_units: list[str]) -> pd.DataFrame:
 
-    # Load ICUSTAYS data
-    filtered_data = data[data['intime'].dt.year == input_yr]
+    # Admissions by weekday x hour over the selected years and units
+    return get_backend().pivot(input_yr, tuple(selected_units))
 
-    if selected_units:
-        pivot_table = filtered_data[filtered_data['first_careunit'].isin(selected_units)]
-    else:
-        pivot_table = filtered_data
-    
-    pivot_table['inweekday'] = pivot_table['intime'].dt.day_name()
-    pivot_table['inhour'] = pivot_table['intime'].dt.round('h').dt.hour
-    pivot_table['inyear'] = pivot_table['intime'].dt.year
+@timed('render')
+def get_heatmap(pivot_table: pd.DataFrame) -> 'plt.Figure':
+
+    import matplotlib.pyplot as plt
+    import seaborn as sns
 
-    pivot_table = pivot_table.groupby([ 'inweekday','inhour',]).size().unstack().reindex(DAYS, )
+    fig, ax = plt.subplots()
+    s = sns.heatmap(pivot_table, ax=ax, cmap='YlOrBr')
+    s.set_ylabel('Admission Day in Week')
+    s.set_xlabel('Admission Hour')
 
-    return pivot_table
+    return fig
 
 def main():
 
     sidebar()
 
-    data = get_dataset('ICUSTAYS')
+    with stage('axes', 'load'):
+        counts = get_backend().admission_axes()
 
     st.title('MIMIC III Visualization #2')
 
     st.header(f'ICU Admission Temporal Pattern')
 
-    #yr = st.slider("Year", min(data['intime'].dt.year),)
-    units = data['first_careunit'].unique()
-    yr = st.slider("Year", min_value=min(data['intime'].dt.year), max_value=max(data['intime'].dt.year))
+    units = counts['units']
+    yr = st.slider("Year", min_value=min(counts['years']), max_value=max(counts['years']),
+                   value=(min(counts['years']), min(counts['years'])))
     container = st.container()
     all = st.checkbox("Select all", value=True)
     
@@ -69,15 +66,21 @@ def main():
         selected_units =  container.multiselect("Care units:",
             units)
         
-    fig, ax = plt.subplots()
-    s = sns.heatmap(get_pivot(data, yr, selected_units), ax=ax, cmap='YlOrBr')
-    s.set_ylabel('Admission Day in Week')
-    s.set_xlabel('Admission Hour')
-    st.write(fig)
+    # Served from the pre-rendered image when there is one
+    image = prerendered('viz_2', yr, tuple(selected_units))
+
+    with stage('heatmap', 'render'):
+        if image is not None:
+            st.image(image)
+        else:
+            st.write(get_heatmap(get_pivot(yr, selected_units)))
     
     if st.checkbox('Show raw data'):
         st.subheader('Raw data')
-        st.write(data)
+        st.write(get_dataset('ICUSTAYS', ['SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 
+                                          'FIRST_CAREUNIT', 'INTIME', 'OUTTIME']))
+
+    diagnostics()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
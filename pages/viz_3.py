@@ -1,16 +1,16 @@
 import streamlit as st
 from dotenv import load_dotenv
 import pandas as pd
-import plotly.express as px
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
-import seaborn as sns
-import os
-from modules.nav import sidebar
+from modules.backend import get_backend
+from modules.cache import cached
+from modules import cohort as cohorts
+from modules.etl import tables_of
+from modules.nav import cohort, diagnostics, sidebar
+from modules.perf import stage, timed
+from modules.prerender import prerendered
+from modules.pathways import MAX_STAGES, build_trie, load_sequences
 
 load_dotenv('.env')
-dir = os.getenv('DIR')
-DATE_COLUMNS = ['intime', 'outtime']
 ICU_MAP = {'CCU':'Coronary care unit', 
         'CSRU': 'Cardiac surgery recovery unit', 
         'CMICU': 'Medical intensive care unit',
@@ -20,52 +20,36 @@ ICU_MAP = {'CCU':'Coronary care unit',
         'TSICU': 'Trauma/surgical intensive care unit'
         }
 
-@st.cache_data
-def load_data() -> pd.DataFrame:
+ALL_UNITS = 'All units'
 
-    # Load ICUSTAYS data
-    data = pd.read_csv(os.path.join(dir, 'TRANSFERS.csv.gz'), compression='gzip')
-    
-    lowercase = lambda x: str(x).lower()
-    data.rename(lowercase, axis='columns', inplace=True)
-
-    for COL in DATE_COLUMNS:
-        data[COL] = pd.to_datetime(data[COL])
-
-    data = data[data['eventtype'] == 'transfer'].dropna()
-    data = data[['subject_id', 'hadm_id', 'eventtype','prev_careunit', 'curr_careunit', 'intime', 'outtime']]
-    #data = data.groupby(['prev_careunit','curr_careunit'])['subject_id'].count().reset_index()
-    
-    return data
+def get_nodes(counts: dict) -> list:
 
-def get_nodes(data :pd.DataFrame) -> list:
-
-    nodes = list(pd.unique(data[['prev_careunit', 'curr_careunit']].values.ravel('K')))
+    nodes = list(counts['units'])
 
     return nodes
 
-def aggregate_data(data, unit, yr):
+@timed('aggregate')
+def aggregate_data(unit, yr):
 
-    agg = data[data['intime'].dt.year == yr]
-    agg = agg.groupby(['prev_careunit','curr_careunit'])['subject_id'].count().reset_index()
-    agg.columns = ['prev_careunit', 'curr_careunit', 'value']
-    agg = agg[agg['prev_careunit'] != agg['curr_careunit']]
-    agg = agg[agg['prev_careunit'] == unit]
+    # Flows out of one unit, or out of every unit, over a year range
+    return get_backend().transfers(None if unit == ALL_UNITS else unit, yr)
 
-    return agg
+@timed('render')
+def get_chart(agg : pd.DataFrame) -> 'go.Figure':
 
-def get_chart(agg : pd.DataFrame) -> go:
+    import plotly.graph_objects as go
 
-    agg['prev_careunit'] = agg['prev_careunit'].map(ICU_MAP)
-    agg['curr_careunit'] = agg['curr_careunit'].map(ICU_MAP)
-    nodes = get_nodes(agg)
-    mapping_dict = {k: v for v, k in enumerate(nodes)}
+    # Source units on the left, destination units on the right
+    sources = list(agg['prev_careunit'].unique())
+    targets = list(agg['curr_careunit'].unique())
+    nodes = [ICU_MAP.get(unit, unit) for unit in sources + targets]
 
     #mapping of full data
-    agg['prev_careunit'] = agg['prev_careunit'].map(mapping_dict)
-    agg['curr_careunit'] = agg['curr_careunit'].map(mapping_dict)
-
-    links_dict = agg.to_dict(orient='list')
+    links_dict = {
+        'prev_careunit': agg['prev_careunit'].map({k: v for v, k in enumerate(sources)}).tolist(),
+        'curr_careunit': agg['curr_careunit'].map({k: v + len(sources) for v, k in enumerate(targets)}).tolist(),
+        'value': agg['value'].tolist(),
+    }
 
     #Sankey Diagram Code 
     fig = go.Figure(data=[go.Sankey(
@@ -84,32 +68,95 @@ def get_chart(agg : pd.DataFrame) -> go:
     ))])
 
     
+    return fig
+
+@timed('load')
+@cached(pin=True, tables=tables_of('pathways'))
+def get_sequences() -> pd.DataFrame:
+
+    return load_sequences()
+
+@timed('aggregate')
+@cached(tables=[*tables_of('pathways'), *cohorts.TABLES])
+def get_pathways(yr, stages, top, criteria: dict = None) -> pd.DataFrame:
+
+    return build_trie(cohorts.in_cohort(get_sequences(), criteria), yr, stages, top)
+
+@timed('render')
+def get_pathway_chart(trie : pd.DataFrame) -> 'go.Figure':
+
+    import plotly.graph_objects as go
+
+    # One node per trie prefix, linked to its parent prefix
+    nodes = [ICU_MAP.get(unit, unit) for unit in trie['UNIT']]
+    links = trie[trie['PARENT'] >= 0]
+
+    fig = go.Figure(data=[go.Sankey(
+        node = dict(
+        pad = 15,
+        thickness = 20,
+        line = dict(color = "black", width = 0.5),
+        label = nodes,
+        ),
+        link = dict(
+        source = links['PARENT'].tolist(),
+        target = links['NODE'].tolist(),
+        value = links['COUNT'].tolist(),
+    ))])
+
     return fig
 
 def main():
 
-    sidebar()
+    # only the pathways apply the cohort, the mode of this rerun is already
+    # in the session state when the sidebar is built
+    sidebar(cohort=st.session_state.get('viz_3_mode') == 'Pathways')
 
     st.title('MIMIC III Visualization #3')
     st.header(f'ICU Transfer Flow')
+    mode = st.radio('Mode', ['Transfers', 'Pathways'], horizontal=True, key='viz_3_mode')
+
     data_load_state = st.text('Loading data...')
-    data = load_data()
+    if mode == 'Pathways':
+        sequences = get_sequences()
+    else:
+        with stage('axes', 'load'):
+            counts = get_backend().transfer_axes()
     data_load_state.text('')
 
-    nodes = get_nodes(data) 
-
-    unit = st.selectbox('ICU Type', nodes)
-    yr = st.number_input("Year", min_value=min(data['intime'].dt.year), max_value=max(data['intime'].dt.year))
-
-    agg = aggregate_data(data, unit, yr)
-
-    fig = get_chart(agg)
-
-    st.plotly_chart(fig)
+    if mode == 'Pathways':
+        years = sequences['YEAR']
+        yr = st.slider("Year", min_value=int(years.min()), max_value=int(years.max()),
+                       value=(int(years.min()), int(years.min())))
+        stages = st.number_input("Stages", min_value=2, max_value=MAX_STAGES, value=4)
+        top = st.number_input("Branches per stage", min_value=1, max_value=10, value=4)
+
+        agg = get_pathways(yr, stages, top, cohort())
+        fig = get_pathway_chart(agg)
+    else:
+        nodes = get_nodes(counts) 
+
+        unit = st.selectbox('ICU Type', nodes + [ALL_UNITS])
+        yr = st.slider("Year", min_value=min(counts['years']), max_value=max(counts['years']),
+                       value=(min(counts['years']), min(counts['years'])))
+
+        # Served from the pre-rendered figure when there is one
+        chart = prerendered('viz_3', unit, yr)
+        if chart is not None:
+            import plotly.io as pio
+            agg, fig = None, pio.from_json(chart)
+        else:
+            agg = aggregate_data(unit, yr)
+            fig = get_chart(agg)
+
+    with stage('plotly_chart', 'render'):
+        st.plotly_chart(fig)
 
     if st.checkbox('Show raw data'):
         st.subheader('Raw data')
-        st.write(agg)
+        st.write(agg if agg is not None else aggregate_data(unit, yr))
+
+    diagnostics()
     
 
     
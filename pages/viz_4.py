@@ -1,64 +1,89 @@
 import streamlit as st
 import pandas as pd
 from dotenv import load_dotenv
-import plotly.graph_objects as go
-import numpy as np
-import random
-import plotly.express as px
-import os, warnings
-
-from modules.nav import sidebar
-DIR = os.getenv('DIR')
-warnings.filterwarnings("ignore")
+import warnings
+
+from modules.backend import get_backend
+from modules.cache import cached
+from modules import cohort as cohorts
+from modules.data import load_table
+from modules.etl import tables_of
+from modules.labs import box_stats
+from modules.nav import cohort, diagnostics, sidebar
+from modules.perf import stage, timed
+from modules.prerender import prerendered
 
 load_dotenv('.env')
-DIR = os.getenv('DIR')
 warnings.filterwarnings("ignore")
 
 
-@st.cache_data
+@timed('load')
+@cached(pin=True, tables=['D_LABITEMS', *tables_of('lab_catalog')])
 def get_lab_items():
 
-    lab_items = pd.read_csv(os.path.join(DIR, 'D_LABITEMS.csv.gz'), compression='gzip')
-  
-    lab_items.drop(['ROW_ID'], axis=1, inplace=True)
-    lab_items['DISPLAY'] = lab_items['CATEGORY'] + ': ' + lab_items['FLUID'] + ' - ' + lab_items['LABEL']
-
-    return lab_items
-
-@st.cache_data
-def get_lab_readings(sampling_size: float):
+    lab_items = load_table('D_LABITEMS', columns=['ITEMID', 'LABEL', 'FLUID', 'CATEGORY'])
+    lab_items['DISPLAY'] = lab_items['CATEGORY'].astype(str) + ': ' \
+                            + lab_items['FLUID'].astype(str) + ' - ' \
+                            + lab_items['LABEL']
 
-    labs = pd.read_csv(os.path.join(DIR, 'LABEVENTS.csv.gz'), 
-                       compression='gzip', skiprows=lambda i: i>0 and random.random() > (sampling_size/100))
-    labs = labs[labs['HADM_ID'].notnull() & labs['VALUENUM'].notnull()]
+    # Only labs that have readings, with their counts
+    lab_items = pd.merge(lab_items, get_backend().lab_counts(), on='ITEMID')
 
-    patients = pd.read_csv(os.path.join(DIR, 'PATIENTS.csv.gz'), compression='gzip')
+    return lab_items
 
-    labs = pd.merge(labs, patients, on='SUBJECT_ID')
-    
-    labs_desc = pd.read_csv(os.path.join(DIR, 'D_LABITEMS.csv.gz'), compression='gzip')
+@timed('load')
+@cached(tables=tables_of('lab_catalog'))
+def get_lab_readings(itemID: int, sampling_size: float):
 
-    labs = pd.merge(labs, labs_desc, on='ITEMID')
-    labs['DISPLAY'] = labs['CATEGORY'] + ' : ' \
-                        + labs['FLUID'] + ' - ' \
-                        + labs['LABEL']
-    
-    labs['COLOR'] = np.where(
-        labs['GENDER'] == 'M', '#636EFA', '#EF553B'
-    )
+    labs = get_backend().lab_readings(itemID, sampling_size, 
+                                      columns=['SUBJECT_ID', 'HADM_ID', 'ITEMID', 
+                                               'VALUENUM', 'VALUEUOM', 'GENDER'])
     
     return labs
 
-def get_result(labs: pd.DataFrame, itemID: int):
+@timed('transform')
+def get_result(labs: pd.DataFrame, itemID: int, criteria: dict = None):
 
     labs = labs[labs['ITEMID'] == itemID]
 
-    return labs
+    return cohorts.in_cohort(labs, criteria)
+
+@timed('aggregate')
+@cached(tables=[*tables_of('lab_catalog'), *cohorts.TABLES])
+def get_box_stats(itemID: int, sampling_size: float, criteria: dict = None):
+
+    labs = get_result(get_lab_readings(itemID, sampling_size), itemID, criteria)
+
+    return box_stats(labs)
+
+@timed('render')
+def get_box_chart(stats: pd.DataFrame, title: str, unit: str) -> 'go.Figure':
+
+    import plotly.colors
+    import plotly.graph_objects as go
+
+    # Only the precomputed summary and the outlier sample go to the browser
+    fig = go.Figure()
+    colors = plotly.colors.qualitative.G10
+    for i, row in enumerate(stats.itertuples()):
+        color = colors[i % len(colors)]
+        fig.add_trace(go.Box(x=[row.GENDER], name=row.GENDER, legendgroup=row.GENDER,
+                             q1=[row.Q1], median=[row.MEDIAN], q3=[row.Q3], mean=[row.MEAN],
+                             lowerfence=[row.LOWERFENCE], upperfence=[row.UPPERFENCE],
+                             marker_color=color))
+        fig.add_trace(go.Scatter(x=[row.GENDER] * len(row.OUTLIERS), y=row.OUTLIERS,
+                                 mode='markers', name=f'{row.GENDER} outliers',
+                                 legendgroup=row.GENDER, showlegend=False,
+                                 marker=dict(color=color, size=4),
+                                 hovertemplate=f'%{{y}} {unit}<extra></extra>'))
+
+    fig.update_layout(title=title, xaxis_title='GENDER', yaxis_title='VALUENUM')
+
+    return fig
 
 def main():
 
-    sidebar()
+    sidebar(cohort=True)
 
     st.title('MIMIC III Visualization #4')
     st.header(f'Lab Readings')
@@ -69,30 +94,50 @@ def main():
 
     with st.expander("Query Parameter", expanded=True):
 
-        sampling_size = st.number_input('Sampling Size (%)', value=5, max_value=100, min_value=1)
+        sampling_size = st.number_input('Sampling Size (%)', value=100, max_value=100, min_value=1)
        
         selected_item = st.selectbox("Lab Type", options=lab_options,
-                     format_func=lambda items: f'{items['DISPLAY']}')
+                     format_func=lambda items: f'{items['DISPLAY']} ({items['ROWS']:,} readings)')
 
-    labs = get_lab_readings(sampling_size)
-    
-    data_load_state.text('')
+        display = st.radio('Points', ['Summary', 'All readings'], horizontal=True,
+                           help='Summary sends only the box statistics and a sample of the outliers')
 
-    data = get_result(labs, selected_item.get('ITEMID'))
+    # Summaries are served from the pre-rendered figure when there is one,
+    # never for a cohort, and the readings are only loaded without one
+    chart = None
+    if display == 'Summary' and not cohort():
+        chart = prerendered('viz_4', selected_item.get('ITEMID'), sampling_size)
 
-    if len(data) == 0:
+    data = None
+    if chart is None:
+        labs = get_lab_readings(selected_item.get('ITEMID'), sampling_size)
+        data = get_result(labs, selected_item.get('ITEMID'), cohort())
+
+    data_load_state.text('')
+
+    if data is not None and len(data) == 0:
         st.write(f'No Data for {selected_item.get('DISPLAY')}')
     else:
         st.write('')
 
-    fig = px.box(data, x="GENDER", y="VALUENUM", color="GENDER",
-             notched=False, # used notched shape
-             title=f'Reading of {selected_item.get('DISPLAY')}',
-             points='all',
-             color_discrete_sequence=px.colors.qualitative.G10,
-             hover_data=["VALUEUOM"],
-             log_y=False
-            )
+    if chart is not None:
+        import plotly.io as pio
+        fig = pio.from_json(chart)
+    elif display == 'Summary':
+        unit = str(data['VALUEUOM'].iloc[0]) if len(data) else ''
+        fig = get_box_chart(get_box_stats(selected_item.get('ITEMID'), sampling_size, cohort()),
+                            f'Reading of {selected_item.get('DISPLAY')}', unit)
+    else:
+        import plotly.express as px
+
+        fig = px.box(data, x="GENDER", y="VALUENUM", color="GENDER",
+                 notched=False, # used notched shape
+                 title=f'Reading of {selected_item.get('DISPLAY')}',
+                 points='all',
+                 color_discrete_sequence=px.colors.qualitative.G10,
+                 hover_data=["VALUEUOM"],
+                 log_y=False
+                )
 
     fig.update_layout(
     yaxis=dict(
@@ -116,11 +161,17 @@ def main():
         showlegend=True
     )
 
-    st.plotly_chart(fig)
+    with stage('plotly_chart', 'render'):
+        st.plotly_chart(fig)
 
     if st.checkbox('Show raw data'):
         st.subheader('Raw data')
+        if data is None:
+            labs = get_lab_readings(selected_item.get('ITEMID'), sampling_size)
+            data = get_result(labs, selected_item.get('ITEMID'), cohort())
         st.write(data)
 
+    diagnostics()
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -2,14 +2,22 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from dotenv import load_dotenv
-import plotly.express as px
 import os, random
-from datetime import datetime
 
-from modules.nav import sidebar
+from modules.cache import cached
+from modules.cohort import in_cohort
+from modules.data import load_table
+from modules.derived import add_age, add_los
+from modules.nav import cohort, diagnostics, sidebar
+from modules.perf import stage, timed
+from modules.prerender import prerendered
+from modules.timeindex import TimeIndex
 
 load_dotenv('.env')
-DIR = os.getenv('DIR')
+# Above this many stays the chart switches from markers to a density grid
+MAX_POINTS = int(os.getenv('MAX_POINTS', 20_000))
+AGE_BINS = 60
+LOS_BINS = 50
 ICU_MAP = {'CCU':'Coronary care unit', 
         'CSRU': 'Cardiac surgery recovery unit', 
         'CMICU': 'Medical intensive care unit',
@@ -20,52 +28,132 @@ ICU_MAP = {'CCU':'Coronary care unit',
         }
 SEED = random.randint(2100, 2210)
 
-@st.cache_data
-def load_data(yr_start: int, 
-              yr_end: int,
-              wards: list[str]) -> pd.DataFrame:
+@timed('load')
+@cached(tables=['PATIENTS', 'ICUSTAYS'])
+def load_data() -> TimeIndex:
     
-    patients = pd.read_csv(os.path.join(DIR, 'PATIENTS.csv.gz'), compression='gzip')
-    icustays = pd.read_csv(os.path.join(DIR, 'ICUSTAYS.csv.gz'), compression='gzip')
+    patients = load_table('PATIENTS', 
+                          columns=['SUBJECT_ID', 'GENDER', 'DOB', 'DOD', 'EXPIRE_FLAG'])
+    icustays = load_table('ICUSTAYS', 
+                          columns=['SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 
+                                   'FIRST_CAREUNIT', 'INTIME', 'OUTTIME', 'LOS'])
 
     data =  pd.merge(patients, icustays, on='SUBJECT_ID')
-    data.drop(['ROW_ID_x','ROW_ID_y'], axis=1, inplace=True)
-
-    DATE_COLS = ['DOB','DOD','INTIME']
-
-    for col in DATE_COLS:
-        data[col] = pd.to_datetime(data[col])
 
     data = data[data['DOB'].dt.year >=2000]
 
-    # Apply calculate_age function to create "age" column
-    data["AGE"] = data.apply(lambda row: calculate_age(row["DOB"], 
-                                                       row["DOD"], 
-                                                       row['EXPIRE_FLAG'],
-                                                       row['INTIME']), 
-                                    axis=1)
+    # Age at death, or at ICU admission for surviving patients
+    data = add_age(data)
+    data = add_los(data)
 
     # Filter out rows with age greater than or equal to 120
     data = data[data["AGE"] < 120]
 
-    data = data[(data['INTIME'].dt.year >= yr_start) & 
-                (data['INTIME'].dt.year <= yr_end)]
+    # Stays of one ward within a year range are a single contiguous slice
+    return TimeIndex(data, 'INTIME', by='FIRST_CAREUNIT')
+
+@timed('transform')
+def filter_data(data: TimeIndex,
+                yr_start: int, 
+                yr_end: int,
+                wards: list[str],
+                criteria: dict = None) -> pd.DataFrame:
+
+    if not wards:
+        return data.data.iloc[0:0]
 
-    data = data[data['FIRST_CAREUNIT'].isin(wards)]
+    return in_cohort(data.slice((yr_start, yr_end), wards), criteria)
 
-    return data
+@timed('aggregate')
+def get_density(data: pd.DataFrame,
+                age_bins: int = AGE_BINS,
+                los_bins: int = LOS_BINS) -> dict:
 
-def calculate_age(dob, dod, expire, MAX_TS: datetime):
+    # Stay counts on an age x log10(LOS) grid per gender, all genders on the
+    # same edges so the panels share their axes and color scale
+    data = data[data['LOS'] > 0]
+    age = data['AGE'].to_numpy(dtype=float)
+    los = np.log10(data['LOS'].to_numpy(dtype=float))
 
-    if expire and dod is not None:
-        age = (dod - dob).days // 365
+    age_edges = np.linspace(0, 120, age_bins + 1)
+    if len(los):
+        los_edges = np.linspace(los.min(), los.max() + 1e-9, los_bins + 1)
     else:
-        age = (MAX_TS - dob).days // 365
-    return age
+        los_edges = np.linspace(-2, 2, los_bins + 1)
+
+    genders = data['GENDER'].astype(str).to_numpy()
+    counts = {}
+    for gender in sorted(set(genders)):
+        mask = genders == gender
+        counts[gender], _, _ = np.histogram2d(age[mask], los[mask],
+                                              bins=[age_edges, los_edges])
+
+    return {'counts': counts, 'age_edges': age_edges, 'los_edges': los_edges}
+
+@timed('render')
+def get_density_chart(density: dict, title: str) -> 'go.Figure':
+
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    age_edges, los_edges = density['age_edges'], density['los_edges']
+    age = (age_edges[:-1] + age_edges[1:]) / 2
+    los = 10 ** ((los_edges[:-1] + los_edges[1:]) / 2)
+
+    genders = list(density['counts'])
+    fig = make_subplots(rows=max(len(genders), 1), cols=1, shared_xaxes=True,
+                        row_titles=[f'GENDER={gender}' for gender in genders],
+                        vertical_spacing=0.05)
+    for i, gender in enumerate(genders):
+        # Empty bins stay transparent
+        counts = density['counts'][gender].T
+        fig.add_trace(go.Heatmap(x=age, y=los, z=np.where(counts > 0, counts, np.nan),
+                                 coloraxis='coloraxis', name=gender,
+                                 hovertemplate='Age %{x:.0f}<br>Lenght of Stay %{y:.2f}'
+                                               '<br>%{z:.0f} stays<extra></extra>'),
+                      row=i + 1, col=1)
+        fig.update_yaxes(type='log', title_text='Lenght of Stay', row=i + 1, col=1)
+
+    fig.update_xaxes(title_text='Age', row=max(len(genders), 1), col=1)
+    fig.update_layout(title=title, width=1400, height=800,
+                      coloraxis=dict(colorscale='Viridis', colorbar_title='Stays'))
+
+    return fig
+
+@timed('render')
+def get_chart(data: pd.DataFrame, yr_start: int, yr_end: int) -> 'go.Figure':
+
+    title = f'Correlation between {yr_start} and {yr_end}'
+    if len(data) > MAX_POINTS:
+        # Too many stays to draw one by one, wards are no longer told apart
+        fig = get_density_chart(get_density(data), title)
+    else:
+        import plotly.express as px
+
+        fig = px.scatter(data,
+                         x='AGE',
+                         y='LOS',
+                         title=title,
+                         color='FIRST_CAREUNIT',
+                         facet_row='GENDER',
+                         #marginal_x='histogram',
+                         width=1400,
+                         height=800,
+                         log_y=True,
+                         render_mode='webgl',
+                         labels=dict(FIRST_CAREUNIT='Ward', 
+                                     LOS='Lenght of Stay',
+                                     AGE='Age'),
+                     
+            )
+
+    fig.update_xaxes(nticks=10)
+
+    return fig
 
 def main():
 
-    sidebar()
+    sidebar(cohort=True)
 
     st.title('MIMIC III Visualization #5')
     st.header(f'Correlation between Age and Length Of Stay')
@@ -84,33 +172,33 @@ def main():
                 ICU_MAP)
 
 
+    # Served from the pre-rendered figure when there is one, never for a
+    # cohort, and the stays are only loaded and filtered without one
     data_load_state = st.text('Loading data...')
-    data = load_data(yr_start, yr_end, selected_units)
+    chart = None if cohort() else prerendered('viz_5', yr_start, yr_end, tuple(selected_units))
+    data = None
+    if chart is None:
+        data = filter_data(load_data(), yr_start, yr_end, selected_units, cohort())
     data_load_state.text('')
 
-    fig = px.scatter(data,
-                     x='AGE',
-                     y='LOS',
-                     title=f'Correlation between {yr_start} and {yr_end}',
-                     color='FIRST_CAREUNIT',
-                     facet_row='GENDER',
-                     #marginal_x='histogram',
-                     width=1400,
-                     height=800,
-                     log_y=True,
-                     labels=dict(FIRST_CAREUNIT='Ward', 
-                                 LOS='Lenght of Stay',
-                                 AGE='Age'),
-                     
-        )
-
-    fig.update_xaxes(nticks=10)
+    if chart is not None:
+        import plotly.io as pio
+        fig = pio.from_json(chart)
+    else:
+        if len(data) > MAX_POINTS:
+            st.caption(f'{len(data):,} stays, shown as a density grid above {MAX_POINTS:,}')
+        fig = get_chart(data, yr_start, yr_end)
 
-    st.plotly_chart(fig)
+    with stage('plotly_chart', 'render'):
+        st.plotly_chart(fig)
 
     if st.checkbox('Show raw data'):
         st.subheader('Raw data')
+        if data is None:
+            data = filter_data(load_data(), yr_start, yr_end, selected_units, cohort())
         st.write(data)
+
+    diagnostics()
     
 
 if __name__ == '__main__':
@@ -0,0 +1,34 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# The modules read their directories from the environment when imported,
+# so the synthetic tables are set up before any of them is
+ROOT = tempfile.mkdtemp(prefix='mimic-tests-')
+os.environ.update({
+    'DIR': os.path.join(ROOT, 'csv'),
+    'CACHE': os.path.join(ROOT, 'parquet'),
+    'OUTPUT': os.path.join(ROOT, 'output'),
+    'WARMUP': '0',
+    'SOURCE_CHECK_SECONDS': '0',
+})
+
+PATIENTS = 2_000
+
+
+@pytest.fixture(scope='session', autouse=True)
+def mimic():
+
+    # Tables, shared exports and artifacts of a small synthetic release,
+    # built once for the whole session
+    from modules import etl, sources, synthetic
+
+    synthetic.generate(os.environ['DIR'], PATIENTS)
+    etl.build(workers=1)
+    sources.reload()
+
+    yield os.environ['DIR']
+
+    shutil.rmtree(ROOT, ignore_errors=True)
@@ -0,0 +1,125 @@
+import os
+
+import pandas as pd
+import pytest
+
+from modules.backend import DAYS, IndexBackend, DatasetBackend
+
+BACKENDS = [IndexBackend(), DatasetBackend()]
+
+
+def read_csv(name: str) -> pd.DataFrame:
+    data = pd.read_csv(os.path.join(os.environ['DIR'], f'{name}.csv.gz'), compression='gzip')
+    return data.drop(columns='ROW_ID')
+
+
+# The pandas logic the pages had before the backends, on the raw CSVs
+
+@pytest.fixture(scope='module')
+def admissions():
+    admissions = read_csv('ADMISSIONS')
+    admissions['ADMITTIME'] = pd.to_datetime(admissions['ADMITTIME'])
+    return admissions
+
+
+@pytest.fixture(scope='module')
+def diagnosis():
+    return pd.merge(read_csv('DIAGNOSES_ICD'), read_csv('D_ICD_DIAGNOSES'), on='ICD9_CODE')
+
+
+@pytest.fixture(scope='module')
+def years(admissions):
+    # The busiest years and one without admissions
+    return admissions['ADMITTIME'].dt.year.value_counts().index[:3].tolist() + [2300]
+
+
+def _edges(data: pd.DataFrame, source: str, target: str, category: str) -> pd.DataFrame:
+
+    edges = data.groupby([source, target])['HADM_ID'].count().reset_index()
+    edges.columns = ['source', 'target', 'weight']
+    edges['category'] = category
+
+    return edges
+
+
+def _sorted(edges: pd.DataFrame) -> pd.DataFrame:
+    edges = edges.astype({'source': str, 'target': str, 'weight': 'int64'})
+    return edges.sort_values(['source', 'target'], ignore_index=True)
+
+
+@pytest.mark.parametrize('backend', BACKENDS, ids=type)
+def test_diagnoses(backend, admissions, diagnosis, years):
+
+    for yr in years:
+        data = pd.merge(admissions[admissions['ADMITTIME'].dt.year == yr], diagnosis, on='HADM_ID')
+        expected = data.groupby('LONG_TITLE')['HADM_ID'].nunique()
+
+        result = backend.diagnoses(yr)
+        assert sorted(result.index) == sorted(expected.index)
+        assert (result[expected.index] == expected).all()
+
+
+@pytest.mark.parametrize('backend', BACKENDS, ids=type)
+def test_edges(backend, admissions, diagnosis, years):
+
+    procs = pd.merge(read_csv('PROCEDURES_ICD'), read_csv('D_ICD_PROCEDURES'), on='ICD9_CODE')
+    prescriptions = read_csv('PRESCRIPTIONS')
+
+    for yr in years:
+        selected = backend.diagnoses(yr).index[:3].tolist()
+        chosen = diagnosis[diagnosis['LONG_TITLE'].isin(selected)]
+        chosen = pd.merge(chosen, admissions[admissions['ADMITTIME'].dt.year == yr], on='HADM_ID')
+
+        # Every edge, ties at the top cut-off make the head order ambiguous
+        expected = _edges(pd.merge(procs, chosen, on='HADM_ID'), 'LONG_TITLE_y', 'LONG_TITLE_x', 'proc')
+        result = backend.edges('proc', selected, yr, top=1 << 30)
+        pd.testing.assert_frame_equal(_sorted(result), _sorted(expected))
+
+        expected = _edges(pd.merge(prescriptions, chosen, on='HADM_ID'), 'LONG_TITLE', 'DRUG', 'drug')
+        result = backend.edges('drug', selected, yr, top=1 << 30)
+        pd.testing.assert_frame_equal(_sorted(result), _sorted(expected))
+
+        top = backend.edges('drug', selected, yr)
+        assert top['weight'].tolist() == expected['weight'].sort_values(ascending=False).head(30).tolist()
+
+
+@pytest.mark.parametrize('backend', BACKENDS, ids=type)
+def test_pivot(backend):
+
+    stays = read_csv('ICUSTAYS')
+    stays['INTIME'] = pd.to_datetime(stays['INTIME'])
+
+    for yr in stays['INTIME'].dt.year.value_counts().index[:3]:
+        for units in [['CCU', 'MICU'], sorted(stays['FIRST_CAREUNIT'].unique())]:
+            data = stays[(stays['INTIME'].dt.year == yr) & stays['FIRST_CAREUNIT'].isin(units)]
+            expected = data.groupby([data['INTIME'].dt.day_name(),
+                                     data['INTIME'].dt.round('h').dt.hour]).size().unstack()
+            expected = expected.reindex(index=DAYS, columns=range(24)).fillna(0)
+
+            result = backend.pivot(int(yr), units)
+            assert (result.to_numpy() == expected.to_numpy()).all()
+
+
+@pytest.mark.parametrize('backend', BACKENDS, ids=type)
+def test_transfers(backend):
+
+    transfers = read_csv('TRANSFERS')
+    transfers['INTIME'] = pd.to_datetime(transfers['INTIME'])
+    transfers = transfers[transfers['EVENTTYPE'] == 'transfer']
+    # Rows missing any of the columns the page kept
+    transfers = transfers.dropna(subset=['SUBJECT_ID', 'HADM_ID', 'PREV_CAREUNIT', 'CURR_CAREUNIT',
+                                         'INTIME', 'OUTTIME'])
+
+    for yr in transfers['INTIME'].dt.year.value_counts().index[:3]:
+        agg = transfers[transfers['INTIME'].dt.year == yr]
+        agg = agg.groupby(['PREV_CAREUNIT', 'CURR_CAREUNIT'])['SUBJECT_ID'].count().reset_index()
+        agg.columns = ['prev_careunit', 'curr_careunit', 'value']
+        agg = agg[agg['prev_careunit'] != agg['curr_careunit']]
+
+        for unit in sorted(agg['prev_careunit'].unique())[:2]:
+            expected = agg[agg['prev_careunit'] == unit].reset_index(drop=True)
+            result = backend.transfers(unit, int(yr))
+            result = result.astype({'prev_careunit': str, 'curr_careunit': str, 'value': 'int64'})
+            pd.testing.assert_frame_equal(
+                result.sort_values(['curr_careunit'], ignore_index=True),
+                expected.sort_values(['curr_careunit'], ignore_index=True))
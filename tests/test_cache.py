@@ -0,0 +1,102 @@
+import threading
+
+import numpy as np
+import pytest
+
+from modules import sources
+from modules.cache import TableCache, cached
+from modules.sources import load_manifest, save_manifest
+
+
+def test_new_fingerprint_drops_pinned_entry():
+
+    cache = TableCache()
+    calls = []
+
+    @cached(pin=True, cache=cache, tables=['NEW_TABLE'])
+    def load():
+        calls.append(1)
+        return np.zeros(4)
+
+    load()
+    manifest = load_manifest()
+    try:
+        # A table fingerprinted for the first time changes the version
+        save_manifest({**manifest, 'sources': {**manifest['sources'],
+                                               'NEW_TABLE': {'size': 0, 'mtime': 0, 'sha256': '0'}}})
+        changed = sources.reload()
+        assert 'NEW_TABLE' in changed
+        cache.invalidate(changed)
+
+        load()
+        assert len(calls) == 2
+        assert cache.stats()['entries'] == 1 and cache.stats()['pinned'] == 1
+    finally:
+        save_manifest(manifest)
+        sources.reload()
+
+
+def test_lru_eviction_within_budget():
+
+    cache = TableCache(budget=3 * 800)
+    for key in 'abc':
+        cache.get(key, lambda: np.zeros(100))
+    cache.get('a', lambda: np.zeros(100))
+
+    # The least recently used entry goes first
+    cache.get('d', lambda: np.zeros(100))
+    assert list(cache.entries) == ['c', 'a', 'd']
+    assert cache.stats()['evictions'] == 1 and cache.used <= cache.budget
+
+    # An entry larger than the whole budget is not kept
+    cache.get('e', lambda: np.zeros(1000))
+    assert 'e' not in cache.entries
+
+
+def test_pinned_entries_are_not_evicted():
+
+    cache = TableCache(budget=2 * 800)
+    cache.get('a', lambda: np.zeros(100), pin=True)
+    for key in 'bcd':
+        cache.get(key, lambda: np.zeros(100))
+    assert list(cache.entries) == ['a', 'd']
+
+    # Unpinned, it is evicted like any other entry
+    cache.unpin('a')
+    cache.get('e', lambda: np.zeros(100))
+    assert list(cache.entries) == ['d', 'e']
+
+
+def test_failed_load_is_retried():
+
+    cache = TableCache()
+
+    def fail():
+        raise ValueError('broken')
+
+    with pytest.raises(ValueError):
+        cache.get('a', fail)
+    assert cache.get('a', lambda: 1) == 1
+    assert not cache._loading
+
+
+def test_clear_drops_pins():
+
+    cache = TableCache()
+    cache.get('a', lambda: np.zeros(100), pin=True)
+    cache.clear()
+    assert not cache.entries and not cache.pinned
+
+
+def test_thread_stats_count_the_calling_thread():
+
+    cache = TableCache()
+    cache.get('a', lambda: np.zeros(4))
+
+    # Lookups of another session are in the totals only
+    worker = threading.Thread(target=lambda: [cache.get('a', lambda: np.zeros(4)) for _ in range(3)])
+    worker.start()
+    worker.join()
+
+    assert cache.thread_stats() == {'hits': 0, 'misses': 1}
+    assert cache.stats()['hits'] == 3 and cache.stats()['misses'] == 1
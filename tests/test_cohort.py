@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+from modules.cohort import CohortIndex, get_cohort_index
+
+
+def small_index() -> CohortIndex:
+
+    # Eleven admissions, not a multiple of eight, given out of order
+    admissions = pd.DataFrame({'HADM_ID': [110, 100, 101, 102, 103, 104, 105, 106, 107, 108, 109],
+                               'SUBJECT_ID': [5, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5]})
+    values = {
+        'GENDER': pd.DataFrame({'HADM_ID': admissions['HADM_ID'],
+                                'VALUE': ['F', 'M', 'M', 'F', 'F', 'M', 'M', 'F', 'F', 'F', 'F']}),
+        'DIAGNOSIS': pd.DataFrame({'HADM_ID': [100, 100, 102, 105, 110, 999],
+                                   'VALUE': ['A', 'B', 'A', 'B', 'A', 'A']}),
+    }
+    return CohortIndex(admissions, values)
+
+
+def test_bitmap_operations():
+
+    index = small_index()
+    women = index.any_of('GENDER', ['F'])
+    a = index.any_of('DIAGNOSIS', ['A'])
+
+    # An admission unknown to the index is ignored
+    assert list(a.hadm_ids()) == [100, 102, 110]
+    assert list((women & a).hadm_ids()) == [102, 110]
+    assert list((women | a).hadm_ids()) == [100, 102, 103, 106, 107, 108, 109, 110]
+
+    # The padding bits of the last byte stay clear
+    assert len(~index.none()) == 11
+    assert list((~a).hadm_ids()) == [101, 103, 104, 105, 106, 107, 108, 109]
+    assert len(index.select({'GENDER': ['M'], 'EXCLUDE': ['B']})) == 2
+    assert list(a.subject_ids()) == [1, 2, 5]
+
+
+def test_take():
+
+    index = small_index()
+    cohort = index.any_of('DIAGNOSIS', ['B'])
+    data = pd.DataFrame({'HADM_ID': pd.array([105, None, 100, 5000, 101, 105], dtype='Int64'),
+                         'SUBJECT_ID': [3, 1, 1, 9, 1, 3]})
+
+    # Missing and unknown ids are dropped, the order of the rows is kept
+    assert list(cohort.take(data).index) == [0, 2, 5]
+    assert list(cohort.take(data, key='SUBJECT_ID').index) == [0, 1, 2, 4, 5]
+
+
+def test_take_matches_isin():
+
+    index = get_cohort_index()
+    cohort = index.any_of('GENDER', ['F']) & ~index.any_of('FIRST_CAREUNIT', index.values('FIRST_CAREUNIT')[:1])
+    data = pd.DataFrame({'HADM_ID': np.concatenate([index.hadm, index.hadm[::3] + 10**7])})
+
+    expected = data[data['HADM_ID'].isin(cohort.hadm_ids())]
+    pd.testing.assert_frame_equal(cohort.take(data), expected)
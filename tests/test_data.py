@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+import pytest
+
+from modules.data import (atomic_path, convert_table, get_table, load_table, memory_report, open_shared,
+                          source_path, table_path)
+from modules.schema import apply_schema
+
+
+def test_shared_columns_view_the_map():
+
+    data = load_table('ICUSTAYS', columns=['SUBJECT_ID', 'FIRST_CAREUNIT'])
+    values = data['SUBJECT_ID'].to_numpy()
+
+    # The ids are read in place from the read-only memory map
+    buffer = open_shared('ICUSTAYS').column('SUBJECT_ID').chunk(0).buffers()[1]
+    assert not buffer.is_mutable
+    assert not values.flags.writeable
+    assert np.shares_memory(values, np.frombuffer(buffer, dtype=np.int32))
+
+    # Categories come out sorted, without reordering the codes
+    assert data['FIRST_CAREUNIT'].cat.categories.is_monotonic_increasing
+
+
+def test_shared_matches_parquet():
+
+    shared = load_table('ICUSTAYS')
+    parquet = apply_schema(pd.read_parquet(table_path('ICUSTAYS')), 'ICUSTAYS')
+
+    pd.testing.assert_frame_equal(shared, parquet)
+
+
+def test_atomic_path(tmp_path):
+
+    path = str(tmp_path / 'counts.npy')
+    with atomic_path(path) as tmp:
+        np.save(tmp, np.arange(3))
+    assert np.load(path).tolist() == [0, 1, 2]
+
+    # A failed write leaves the previous file and no temporary behind
+    with pytest.raises(ValueError):
+        with atomic_path(path) as tmp:
+            np.save(tmp, np.arange(5))
+            raise ValueError('interrupted')
+    assert np.load(path).tolist() == [0, 1, 2]
+    assert os.listdir(tmp_path) == ['counts.npy']
+
+
+def test_replace_swaps_versions():
+
+    target = table_path('D_LABITEMS')
+    rows = get_table('D_LABITEMS').count_rows()
+    before = os.path.realpath(target)
+
+    # The table path moves to a new complete version in one step, the
+    # previous version is removed
+    convert_table('D_LABITEMS', replace=True)
+    assert os.path.islink(target) and os.path.realpath(target) != before
+    assert not os.path.exists(before)
+    assert ds.dataset(target, format='parquet').count_rows() == rows
+
+    # Without replace the current version is kept
+    current = os.path.realpath(target)
+    convert_table('D_LABITEMS')
+    assert os.path.realpath(target) == current
+    assert not [name for name in os.listdir(os.path.dirname(target))
+                if name.startswith('D_LABITEMS.') and os.path.join(os.path.dirname(target), name) != current]
+
+
+def test_memory_report_every_column():
+
+    # Columns outside the registry count too, on both sides
+    report = memory_report(['D_ICD_DIAGNOSES']).iloc[0]
+    assert report['ROWS'] == len(pd.read_csv(source_path('D_ICD_DIAGNOSES')))
+    assert report['COMPACT_MB'] > 0 and report['DEFAULT_MB'] > 0
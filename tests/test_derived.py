@@ -0,0 +1,38 @@
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from modules.derived import add_age
+
+
+def calculate_age(dob, dod, expire, MAX_TS: datetime):
+
+    # The row-wise age viz_5 computed before add_age
+    if expire and dod is not None:
+        age = (dod - dob).days // 365
+    else:
+        age = (MAX_TS - dob).days // 365
+    return age
+
+
+@pytest.fixture(scope='module')
+def stays():
+    patients = pd.read_csv(os.path.join(os.environ['DIR'], 'PATIENTS.csv.gz'), compression='gzip')
+    icustays = pd.read_csv(os.path.join(os.environ['DIR'], 'ICUSTAYS.csv.gz'), compression='gzip')
+    data = pd.merge(patients, icustays, on='SUBJECT_ID')
+    for col in ['DOB', 'DOD', 'INTIME']:
+        data[col] = pd.to_datetime(data[col])
+    # The shifted birth dates of the oldest patients were dropped first
+    return data[data['DOB'].dt.year >= 2000]
+
+
+def test_add_age(stays):
+
+    expected = stays.apply(lambda row: calculate_age(row['DOB'], row['DOD'], row['EXPIRE_FLAG'],
+                                                     row['INTIME']), axis=1)
+
+    result = add_age(stays)['AGE']
+    assert np.array_equal(result.to_numpy(dtype=float), expected.to_numpy(dtype=float), equal_nan=True)
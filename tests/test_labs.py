@@ -0,0 +1,87 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+import pytest
+
+from modules.data import get_table, load_table
+from modules.labs import GENDERS, box_stats, build_lab_catalog, load_lab_catalog, read_lab_sample
+
+COLUMNS = ['SUBJECT_ID', 'HADM_ID', 'ITEMID', 'VALUENUM', 'GENDER']
+
+
+@pytest.fixture(scope='module')
+def entry():
+    # The item with the most readings
+    catalog = load_lab_catalog()
+    return catalog.sort_values('ROWS').iloc[-1]
+
+
+def test_sample_is_deterministic(entry):
+
+    sample = read_lab_sample(entry, 30, columns=COLUMNS)
+
+    # The same rows on every read and after rebuilding the catalog
+    pd.testing.assert_frame_equal(read_lab_sample(entry, 30, columns=COLUMNS), sample)
+    catalog = build_lab_catalog()
+    rebuilt = catalog[catalog['ITEMID'] == entry['ITEMID']].iloc[0]
+    pd.testing.assert_frame_equal(read_lab_sample(rebuilt, 30, columns=COLUMNS), sample)
+
+    # A larger sample extends the smaller one within each gender
+    larger = read_lab_sample(entry, 60, columns=COLUMNS)
+    for gender in GENDERS:
+        rows = int(entry[f'ROWS_{gender}'])
+        part = sample[sample['GENDER'] == gender].reset_index(drop=True)
+        assert len(part) == math.ceil(rows * 30 / 100)
+        pd.testing.assert_frame_equal(
+            larger[larger['GENDER'] == gender].reset_index(drop=True).iloc[:len(part)], part)
+
+
+def test_full_sample_has_every_reading(entry):
+
+    sample = read_lab_sample(entry, 100, columns=['HADM_ID', 'ITEMID', 'VALUENUM', 'GENDER'])
+    assert (sample['ITEMID'] == entry['ITEMID']).all()
+
+    labs = get_table('LABEVENTS').to_table(
+        columns=['SUBJECT_ID', 'HADM_ID', 'VALUENUM'],
+        filter=(ds.field('ITEMID') == int(entry['ITEMID']))
+               & ds.field('HADM_ID').is_valid() & ds.field('VALUENUM').is_valid()
+    ).to_pandas()
+    patients = load_table('PATIENTS', columns=['SUBJECT_ID', 'GENDER'])
+    labs = labs.merge(patients[patients['GENDER'].isin(GENDERS)], on='SUBJECT_ID')
+
+    key = ['HADM_ID', 'VALUENUM']
+    assert len(sample) == len(labs) == entry['ROWS']
+    pd.testing.assert_frame_equal(sample[key].sort_values(key, ignore_index=True),
+                                  labs[key].sort_values(key, ignore_index=True), check_dtype=False)
+
+
+def test_box_stats():
+
+    rng = np.random.default_rng(0)
+    values = np.concatenate([rng.normal(10, 1, 500), [30, 31, -10], rng.normal(10, 1, 300)])
+    data = pd.DataFrame({'VALUENUM': values, 'GENDER': ['F'] * 503 + ['M'] * 300})
+    data.loc[3, 'VALUENUM'] = np.nan
+
+    stats = box_stats(data, max_outliers=2).set_index('GENDER')
+    for gender, group in data.dropna().groupby('GENDER'):
+        values = group['VALUENUM']
+        q1, q3 = values.quantile(.25), values.quantile(.75)
+        low, high = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+        row = stats.loc[gender]
+
+        assert row['N'] == len(values)
+        assert row['MEDIAN'] == pytest.approx(values.median())
+        assert row['Q1'] == pytest.approx(q1) and row['Q3'] == pytest.approx(q3)
+        # The whiskers end at the furthest readings inside the fences
+        assert row['LOWERFENCE'] == values[values >= low].min()
+        assert row['UPPERFENCE'] == values[values <= high].max()
+
+        # The outlier sample is capped and keeps both extremes
+        outliers = np.sort(values[(values < low) | (values > high)])
+        assert len(row['OUTLIERS']) == min(len(outliers), 2)
+        if len(outliers) >= 2:
+            assert list(row['OUTLIERS']) == [outliers[0], outliers[-1]]
+
+    assert list(stats.loc['F', 'OUTLIERS']) == [-10, 31]
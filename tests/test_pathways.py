@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+
+from modules.pathways import build_trie, load_sequences
+
+
+def _paths(trie: pd.DataFrame) -> dict:
+
+    # Units from the root down to every node
+    nodes = trie.set_index('NODE')
+    paths = {}
+    for node, row in nodes.iterrows():
+        paths[node] = (paths[row['PARENT']] if row['PARENT'] >= 0 else ()) + (row['UNIT'],)
+
+    return {paths[node]: count for node, count in nodes['COUNT'].items()}
+
+
+@pytest.mark.parametrize('stages', [1, 3, 6])
+def test_trie_counts(stages):
+
+    sequences = load_sequences()
+    yr = int(sequences['YEAR'].mode()[0])
+
+    # Admissions sharing every prefix of their own path
+    expected = {}
+    admissions = sequences[sequences['YEAR'] == yr].sort_values(['HADM_ID', 'STEP'])
+    for _, units in admissions.groupby('HADM_ID')['UNIT']:
+        path = tuple(units.astype(str))[:stages]
+        for depth in range(1, len(path) + 1):
+            expected[path[:depth]] = expected.get(path[:depth], 0) + 1
+
+    assert _paths(build_trie(sequences, yr, stages, top=1 << 30)) == expected
+
+    # Pruned branches keep their admissions in an Other node
+    pruned = build_trie(sequences, yr, stages, top=2)
+    for depth, nodes in pruned.groupby('DEPTH'):
+        assert nodes.groupby('PARENT')['UNIT'].count().max() <= 3
+        children = nodes.groupby('PARENT')['COUNT'].sum()
+        parents = pruned.set_index('NODE')['COUNT']
+        if depth:
+            assert (children <= parents[children.index]).all()
+        else:
+            assert children.sum() == admissions['HADM_ID'].nunique()
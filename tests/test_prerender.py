@@ -0,0 +1,47 @@
+import json
+import os
+
+import pytest
+
+from modules import prerender, sources
+from modules.sources import load_manifest, save_manifest
+
+
+@pytest.fixture(scope='module')
+def rendered():
+    manifest = prerender.render(['viz_5'], workers=1)
+    return prerender.VIEWS['viz_5']['grid'](), manifest
+
+
+def test_hit_and_miss(rendered):
+
+    grid, manifest = rendered
+    params = grid[0]
+    entry = manifest[prerender.key('viz_5', params)]
+
+    content = prerender.prerendered('viz_5', *params)
+    with open(os.path.join(prerender.PRERENDER, entry['file']), 'rb') as f:
+        assert content == f.read()
+    assert 'data' in json.loads(content)
+
+    # Parameters outside the grid are rendered live
+    assert prerender.prerendered('viz_5', 2100, 2101, params[2]) is None
+
+
+def test_new_source_version_invalidates(rendered):
+
+    grid, _ = rendered
+    manifest = load_manifest()
+    try:
+        # A rebuilt source table makes the rendered entries stale
+        patients = {**manifest['sources']['PATIENTS'], 'sha256': '0'}
+        save_manifest({**manifest, 'sources': {**manifest['sources'], 'PATIENTS': patients}})
+        sources.reload()
+        assert prerender.prerendered('viz_5', *grid[0]) is None
+
+        # and a new render makes them current again
+        prerender.render(['viz_5'], workers=1)
+        assert prerender.prerendered('viz_5', *grid[0]) is not None
+    finally:
+        save_manifest(manifest)
+        sources.reload()
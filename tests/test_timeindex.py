@@ -0,0 +1,22 @@
+from modules.data import load_table
+from modules.timeindex import TimeIndex
+
+
+def test_time_index_slice():
+
+    data = load_table('ICUSTAYS', columns=['ICUSTAY_ID', 'FIRST_CAREUNIT', 'INTIME'])
+    index = TimeIndex(data, 'INTIME', by='FIRST_CAREUNIT')
+    plain = TimeIndex(data, 'INTIME')
+    year = data['INTIME'].dt.year
+    units = sorted(data['FIRST_CAREUNIT'].dropna().astype(str).unique())
+
+    for yr in [year.min(), (2120, 2150), (2150, 2120), (1900, 2400)]:
+        yr_start, yr_end = yr if isinstance(yr, tuple) else (yr, yr)
+        in_years = year.between(yr_start, yr_end)
+
+        expected = data.loc[in_years, 'ICUSTAY_ID']
+        assert sorted(plain.slice(yr)['ICUSTAY_ID']) == sorted(expected)
+
+        for keys in [None, units[:2]]:
+            mask = in_years & data['FIRST_CAREUNIT'].astype(str).isin(keys or units)
+            assert sorted(index.slice(yr, keys)['ICUSTAY_ID']) == sorted(data.loc[mask, 'ICUSTAY_ID'])